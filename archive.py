@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+
+# each hot table with the columns its archive copy keeps
+TABLES = {
+	"characters": "id,name,active,char_id,player_id,dice_pool,game_id,journal_id",
+	"moves": "id,char_id,character_id,dice,name,used",
+	"consequences": "id,char_id,character_id,dice,name",
+	"journal": "id,character_id,kind,added,removed,ref,detail,at,undone",
+}
+
+
+# archived characters move, with their moves, consequences and journal, out of the hot
+# tables into archive_* copies a batch at a time, so rosters and the character_id
+# indexes only hold live games however many have been played. the moves run on the
+# writer thread between commands, and the file is vacuumed once enough of it is free
+class Archiver():
+	def __init__(self,db,batch=500,interval=3600,vacuum_ratio=0.25):
+		self.db = db
+		self.batch = batch
+		self.interval = interval
+		self.vacuum_ratio = vacuum_ratio
+
+	# one batch, in one transaction. returns how many characters moved
+	def archive_batch(self,con):
+		ids = [r[0] for r in con.execute("SELECT id FROM characters WHERE active = 0 LIMIT ?",[self.batch])]
+		if not ids:
+			return 0
+
+		marks = ','.join('?'*len(ids))
+		try:
+			con.execute(f"INSERT INTO archive_characters ({TABLES['characters']},archived_at) SELECT {TABLES['characters']},? FROM characters WHERE id IN ({marks})",[time.time()]+ids)
+			for t in ["moves","consequences","journal"]:
+				con.execute(f"INSERT INTO archive_{t} ({TABLES[t]}) SELECT {TABLES[t]} FROM {t} WHERE character_id IN ({marks})",ids)
+			# moves, consequences and journal go with them through ON DELETE CASCADE
+			con.execute(f"DELETE FROM characters WHERE id IN ({marks})",ids)
+			con.commit()
+		except Exception:
+			con.rollback()
+			raise
+
+		self.db.metrics.count("archived",len(ids))
+		return len(ids)
+
+	# vacuum once the free pages left behind by archiving pass vacuum_ratio of the file
+	def compact(self,con):
+		free = con.execute("PRAGMA freelist_count").fetchone()[0]
+		pages = con.execute("PRAGMA page_count").fetchone()[0]
+		if pages and free/pages >= self.vacuum_ratio:
+			con.execute("VACUUM")
+			self.db.metrics.count("vacuums")
+			return True
+		return False
+
+	async def run(self):
+		writer = lambda fn: asyncio.wrap_future(self.db.writer.submit(lambda: fn(self.db.con)))
+		while await writer(self.archive_batch):
+			pass
+		await writer(self.compact)
+
+	async def run_every(self):
+		while True:
+			await self.run()
+			await asyncio.sleep(self.interval)
+
+	# the most recent archived character in the game whose name starts with name, wherever
+	# it is right now: (row, moves, consequences, journal) or None
+	async def find(self,game,name):
+		pattern = name.replace('\\','\\\\').replace('%','\\%').replace('_','\\_')+'%'
+		for prefix in ["","archive_"]:
+			rows = await self.db.read(f"SELECT {TABLES['characters']} FROM {prefix}characters WHERE game_id = ? AND active = 0 AND name LIKE ? ESCAPE '\\' ORDER BY id DESC LIMIT 1",[game,pattern])
+			if rows:
+				i = rows[0][0]
+				moves = await self.db.read(f"SELECT character_id,char_id,dice,name,used,id FROM {prefix}moves WHERE character_id = ? ORDER BY char_id",[i])
+				consequences = await self.db.read(f"SELECT character_id,char_id,dice,name,id FROM {prefix}consequences WHERE character_id = ? ORDER BY char_id",[i])
+				journal = await self.db.read(f"SELECT id,added,removed FROM {prefix}journal WHERE character_id = ? AND id > ? ORDER BY id",[i,rows[0][7] or 0])
+				return rows[0], moves, consequences, journal
+		return None
+
+	# statements bringing a character back as active. they copy it out of the archive if
+	# it's there by the time they commit and are no-ops otherwise, so it doesn't matter
+	# whether a batch moved it in between
+	def restore(self,i,char_id):
+		statements = [(f"INSERT OR IGNORE INTO characters ({TABLES['characters']}) SELECT {TABLES['characters']} FROM archive_characters WHERE id = ?",[i])]
+		statements += [(f"INSERT OR IGNORE INTO {t} ({TABLES[t]}) SELECT {TABLES[t]} FROM archive_{t} WHERE character_id = ?",[i]) for t in ["moves","consequences","journal"]]
+		statements += [("DELETE FROM archive_characters WHERE id = ?",[i])]
+		statements += [("UPDATE characters SET active = 1, char_id = ?, player_id = '' WHERE id = ?",[char_id,i])]
+		self.db.write_many(statements)
@@ -0,0 +1,148 @@
+# end to end command throughput: builds games of various sizes, then plays a mix of
+# commands through Bot.on_message and reports throughput, p50/p99 latency and queries
+# per command. results can be saved and compared between versions
+#
+#   python benchmarks/bench_commands.py [--out results.json] [--compare old.json] [--commands N]
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from harness import Harness, percentile
+
+
+# (name, characters per game, games, moves per character, dice rolled into each pool)
+scenarios = [
+	("small table",5,1,4,6),
+	("full table",50,1,10,20),
+	("long sheets",5,1,40,100),
+	("500 across 10 games",50,10,6,10),
+]
+
+mix = [
+	("view sheet",30),
+	("view dpools",8),
+	("view chars",8),
+	("roll",8),
+	("plus dice",10),
+	("plus move",8),
+	("raise",10),
+	("call",6),
+	("add consequence",6),
+	("view cpool",6),
+]
+
+
+async def setup(h,chars,games,moves,pool):
+	for g in range(games):
+		channel = g+1
+		await h.send("dq new game "+", ".join(f"Hero{i:03d}" for i in range(chars)),1,channel)
+		for i in range(chars):
+			author = g*chars+i+1
+			await h.send(f"dq set char Hero{i:03d}",author,channel)
+			for j in range(moves):
+				await h.send(f"dq +m {random.randint(1,4)}d{random.choice([4,6,8,10])} Move{j:02d}",author,channel)
+			await h.send(f"dq + {pool}d6",author,channel)
+	await h.drain()
+
+
+def pick(h,chars,games,rng):
+	g = rng.randrange(games)
+	author = g*chars+rng.randrange(chars)+1
+	char = h.bot.players.get((f"{h.guild.id}:{g+1}",str(author)))
+	kind = rng.choices([k for k,w in mix],[w for k,w in mix])[0]
+	dice = list(char.dice) if char else []
+
+	if kind in ("raise","call") and len(dice) < 2:
+		kind = "plus dice"
+
+	content = {
+		"view sheet": "dq view sheet",
+		"view dpools": "dq view dpools",
+		"view chars": "dq view chars",
+		"view cpool": "dq view cpool",
+		"roll": "dq roll 3d6",
+		"plus dice": "dq + 4d6",
+		"plus move": "dq + Move00",
+		"raise": f"dq raise {dice[0]} {dice[1]}" if len(dice) > 1 else "",
+		"call": f"dq call {dice[-1]}" if dice else "",
+		"add consequence": "dq +c 1d4 bruised",
+	}[kind]
+	return kind,content,author,g+1
+
+
+async def run(name,chars,games,moves,pool,commands,seed=1):
+	rng = random.Random(seed)
+	random.seed(seed)
+	h = Harness()
+	try:
+		await setup(h,chars,games,moves,pool)
+		h.latencies = []
+		h.errors = h.rejected = 0
+		h.bot.metrics.queries.clear()
+		db_before = dict(h.bot.metrics.totals)
+
+		kinds = {}
+		start = time.perf_counter()
+		for i in range(commands):
+			kind,content,author,channel = pick(h,chars,games,rng)
+			kinds.setdefault(kind,[]).append(await h.send(content,author,channel))
+		elapsed = time.perf_counter()-start
+		await h.drain()
+
+		latencies = [l for k,l in h.latencies]
+		queries = sum(h.bot.metrics.queries.values())
+		db = {k:v-db_before.get(k,0) for k,v in h.bot.metrics.totals.items()}
+		return {
+			"scenario": name,
+			"commands": commands,
+			"throughput": commands/elapsed,
+			"p50_ms": percentile(latencies,0.5)*1000,
+			"p99_ms": percentile(latencies,0.99)*1000,
+			"queries_per_command": queries/commands,
+			"db": db,
+			"errors": h.errors,
+			"rejected": h.rejected,
+			"by_command": {k:{"n":len(v),"p50_ms":percentile(v,0.5)*1000,"p99_ms":percentile(v,0.99)*1000} for k,v in sorted(kinds.items())},
+		}
+	finally:
+		h.close()
+
+
+def report(results,previous=None):
+	previous = {r["scenario"]:r for r in previous or []}
+	print(f"{'scenario':<22} {'cmd/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'q/cmd':>6} {'errors':>6} {'rejected':>8}")
+	for r in results:
+		print(f"{r['scenario']:<22} {r['throughput']:>9.0f} {r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f} {r['queries_per_command']:>6.2f} {r['errors']:>6} {r['rejected']:>8}")
+		old = previous.get(r["scenario"])
+		if old:
+			print(f"{'  vs previous':<22} {r['throughput']/old['throughput']-1:>+9.1%} {r['p50_ms']/old['p50_ms']-1:>+8.1%} {r['p99_ms']/old['p99_ms']-1:>+8.1%} {r['queries_per_command']-old['queries_per_command']:>+6.2f}")
+
+
+async def main(args):
+	results = []
+	for scenario in scenarios:
+		results.append(await run(*scenario,args.commands))
+
+	previous = None
+	if args.compare:
+		with open(args.compare) as f:
+			previous = json.load(f)["results"]
+	report(results,previous)
+
+	if args.out:
+		with open(args.out,"w") as f:
+			json.dump({"time":time.time(),"results":results},f,indent=1)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--commands",type=int,default=2000)
+	parser.add_argument("--out")
+	parser.add_argument("--compare")
+	asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,61 @@
+# dispatch cost of the compiled router against the old linear startswith scan,
+# as the number of registered commands grows
+#
+#   python benchmarks/bench_router.py
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from router import Router
+
+
+REPEAT = 20000
+
+routes = [
+	("+c {consequence}","+c","+c 1d4 bruised"),
+	("+m {move}","+m","+m 2d6 Body"),
+	("+ {dice:dice}","+","+ 3d6"),
+	("-c {indicator}","-c","-c A"),
+	("-m {indicator}","-m","-m A"),
+	("- {values}","-","- 4 5"),
+	("add char {name}","add char","add char Brother Ezekiel"),
+	("call {values}","call","call 4 5 6"),
+	("new game {names}","new game","new game a, b, c"),
+	("raise {values}","raise","raise 6 5"),
+	("roll {dice:dice}","roll","roll 4d10"),
+	("set char {indicator}","set char","set char ez"),
+	("view dpools","view dpools","view dpools"),
+	("view {indicator}","view","view ez"),
+]
+
+
+def handler(m,**args):
+	pass
+
+
+def linear(commands,text):
+	for command,method in commands:
+		if text.startswith(command):
+			return method
+
+
+def main():
+	print(f"{'commands':>9} {'linear us':>10} {'router us':>10}")
+	for extra in [0,50,200,1000]:
+		padding = [(f"extra{i} {{arg}}",f"extra{i}",None) for i in range(extra)]
+		table = padding+routes
+		router = Router([(r,handler) for r,_,_ in table])
+		commands = [(p,handler) for _,p,_ in table]
+		texts = [t for _,_,t in routes]
+		router.resolve(texts[0])
+
+		lin = timeit.timeit(lambda: [linear(commands,t) for t in texts],number=REPEAT//len(texts))
+		rou = timeit.timeit(lambda: [router.resolve(t) for t in texts],number=REPEAT//len(texts))
+		print(f"{len(table):>9} {lin/REPEAT*1e6:>10.3f} {rou/REPEAT*1e6:>10.3f}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,77 @@
+# query latency on the hot lookups as archived rows pile up, before (schema v1,
+# no indexes) and after the migrations
+#
+#   python benchmarks/bench_schema.py [archived sizes...]
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import migrations
+
+
+ACTIVE = 10
+REPEAT = 200
+LAST = None
+
+queries = [
+	("roster","SELECT rowid,name,char_id FROM characters WHERE active = 1 ORDER BY char_id",lambda: []),
+	("player","SELECT rowid FROM characters WHERE player_id = ?",lambda: ["p3"]),
+	("moves","SELECT char_id,dice,name,used,rowid FROM moves WHERE character_id = ? ORDER BY char_id",lambda: [LAST]),
+	("consequences","SELECT char_id,dice,name,rowid FROM consequences WHERE character_id = ? ORDER BY char_id",lambda: [LAST]),
+	("load moves","SELECT m.character_id,m.char_id,m.dice,m.name,m.used,m.rowid FROM moves m JOIN characters c ON c.rowid = m.character_id WHERE c.active = 1 ORDER BY m.char_id",lambda: []),
+]
+
+
+def populate(con,archived):
+	global LAST
+	chars = [(f"old {i}",0,"A",'',"3 2 1") for i in range(archived)]
+	chars += [(f"char {i}",1,chr(65+i),f"p{i}","6 5 4") for i in range(ACTIVE)]
+	con.executemany("INSERT INTO characters (name,active,char_id,player_id,dice_pool) VALUES (?,?,?,?,?)",chars)
+	ids = [r[0] for r in con.execute("SELECT rowid FROM characters")]
+	LAST = ids[-1]
+	con.executemany("INSERT INTO moves (char_id,character_id,dice,name,used) VALUES (?,?,?,?,0)",[(l,i,"2d6",f"move {l}") for i in ids for l in "ABC"])
+	con.executemany("INSERT INTO consequences (char_id,character_id,dice,name) VALUES (?,?,?,?)",[("A",i,"1d4","cut") for i in ids])
+	con.commit()
+
+
+def time_queries(con):
+	results = {}
+	for name,sql,params in queries:
+		p = params()
+		start = time.perf_counter()
+		for i in range(REPEAT):
+			con.execute(sql,p).fetchall()
+		results[name] = (time.perf_counter()-start)/REPEAT*1000
+	return results
+
+
+def run(archived,version):
+	fd,path = tempfile.mkstemp(suffix=".db")
+	os.close(fd)
+	con = sqlite3.connect(path)
+	try:
+		migrations.migrate(con,1)
+		populate(con,archived)
+		migrations.migrate(con,version)
+		return time_queries(con)
+	finally:
+		con.close()
+		os.remove(path)
+
+
+def main(sizes):
+	latest = len(migrations.migrations)
+	print(f"{'archived':>9} {'query':<14} {'v1 ms':>9} {'v'+str(latest)+' ms':>9}")
+	for n in sizes:
+		before = run(n,1)
+		after = run(n,latest)
+		for name,*_ in queries:
+			print(f"{n:>9} {name:<14} {before[name]:>9.3f} {after[name]:>9.3f}")
+
+
+if __name__ == "__main__":
+	main([int(a) for a in sys.argv[1:]] or [0,1000,10000,100000])
@@ -0,0 +1,71 @@
+# commit throughput and latency under each storage profile, with commands shaped like
+# the bot's: a journal append per command, through Storage.transaction. fsync costs
+# depend on the disk, so point --dir at the one the bot runs on (/tmp is often tmpfs)
+#
+#   python benchmarks/bench_storage.py [--commits 2000] [--concurrency 1] [--dir path] [profiles...]
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+import migrations
+from storage import Storage, profiles
+
+
+def percentile(values,q):
+	values = sorted(values)
+	return values[min(len(values)-1,int(q*len(values)))] if values else 0.0
+
+
+async def commits(db,n,character):
+	latencies = []
+	for _ in range(n):
+		start = time.perf_counter()
+		async with db.transaction():
+			i = db.next_rowid("journal")
+			db.write("INSERT INTO journal (id,character_id,kind,added,removed,at) VALUES (?,?,?,?,?,?)",[i,character,"rolled","6:1,4:2",None,time.time()])
+		latencies.append(time.perf_counter()-start)
+	return latencies
+
+
+async def bench(name,directory,n,concurrency):
+	with tempfile.TemporaryDirectory(dir=directory) as tmp:
+		path = os.path.join(tmp,"bench.db")
+		db = Storage(path,profile=name)
+		db.check()
+		db.run(migrations.migrate)
+		db.run(lambda con: (con.execute("INSERT INTO characters (id,name,active,char_id,game_id) VALUES (1,'A',1,'A','1:1')"),con.commit()))
+		db.load_rowids(["journal"])
+
+		start = time.perf_counter()
+		runs = await asyncio.gather(*[commits(db,n//concurrency,1) for _ in range(concurrency)])
+		elapsed = time.perf_counter()-start
+		latencies = [l for run in runs for l in run]
+
+		wal = os.path.getsize(path+"-wal") if os.path.exists(path+"-wal") else 0
+		db.run(lambda con: con.close())
+		db.close()
+
+	print(f"{name:<10} {len(latencies)/elapsed:>8.0f} {percentile(latencies,0.5)*1000:>8.3f} {percentile(latencies,0.99)*1000:>8.3f} {wal/1024:>8.0f}")
+
+
+async def main(args):
+	print(f"{'profile':<10} {'commit/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'wal KiB':>8}")
+	for name in args.profiles or profiles:
+		await bench(name,args.dir,args.commits,args.concurrency)
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("profiles",nargs="*",help=", ".join(profiles))
+	parser.add_argument("--commits",type=int,default=2000)
+	parser.add_argument("--concurrency",type=int,default=1)
+	parser.add_argument("--dir")
+	args = parser.parse_args()
+	if set(args.profiles)-set(profiles):
+		parser.error(f"profiles are {', '.join(profiles)}")
+	asyncio.run(main(args))
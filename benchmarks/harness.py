@@ -0,0 +1,97 @@
+# drives a real Bot offline: fake discord messages whose replies are recorded, and a
+# throwaway sqlite file instead of db.db
+
+import itertools
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),'..'))
+from bot import Bot
+
+
+class FakeAuthor():
+	def __init__(self,id,bot=False):
+		self.id = id
+		self.bot = bot
+
+
+class FakeGuild():
+	def __init__(self,id):
+		self.id = id
+
+
+class FakeChannel():
+	def __init__(self,id):
+		self.id = id
+
+
+class FakeMessage():
+	def __init__(self,content,author,channel,guild,replies=None,id=None):
+		self.id = id
+		self.content = content
+		self.author = author
+		self.channel = channel
+		self.guild = guild
+		self.replies = replies if replies is not None else []
+
+	async def reply(self,content,**kwargs):
+		self.replies.append((self,content))
+
+
+# a Bot with its database in a temp dir and its outbox set to deliver immediately
+class Harness():
+	def __init__(self,path=None,guild=1):
+		self.dir = None
+		if not path:
+			self.dir = tempfile.TemporaryDirectory()
+			path = os.path.join(self.dir.name,"bench.db")
+
+		self.bot = Bot(debug=True)
+		self.bot.logger.setLevel(logging.WARNING)
+		self.bot.outbox.window = 0
+		# one reply per command, so errors and rejections are counted per command
+		self.bot.outbox.small = 0
+		self.bot.outbox.rate = self.bot.outbox.burst = 1e9
+		self.bot.setup_db(path)
+
+		self.guild = FakeGuild(guild)
+		self.ids = itertools.count(1)
+		self.replies = []
+		self.latencies = []
+		self.errors = 0
+		self.rejected = 0
+
+	def message(self,content,author=1,channel=1,guild=None,id=None):
+		guild = FakeGuild(guild) if guild else self.guild
+		return FakeMessage(content,FakeAuthor(author),FakeChannel(channel),guild,self.replies,id or next(self.ids))
+
+	# send one message through on_message, returning how long the bot took with it
+	async def send(self,content,author=1,channel=1,guild=None,id=None):
+		m = self.message(content,author,channel,guild,id)
+		start = time.perf_counter()
+		await self.bot.on_message(m)
+		elapsed = time.perf_counter()-start
+		self.latencies.append((content.split(' ')[1] if ' ' in content else content,elapsed))
+		return elapsed
+
+	async def drain(self):
+		await self.bot.outbox.drain()
+		replies, self.replies[:] = list(self.replies), []
+		self.errors += sum(1 for c,r in replies if "ERROR: " in r)
+		self.rejected += sum(1 for c,r in replies if "Hold up: " in r)
+		return replies
+
+	def close(self):
+		self.bot.db.close()
+		if self.dir:
+			self.dir.cleanup()
+
+
+def percentile(values,q):
+	values = sorted(values)
+	if not values:
+		return 0.0
+	return values[min(len(values)-1,int(q*len(values)))]
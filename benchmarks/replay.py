@@ -0,0 +1,132 @@
+# plays back a session captured with DOGSBOT_RECORD=path against a local bot. each
+# recorded channel plays in its own task, at the original pacing (--speed 1), faster
+# (--speed 10) or as fast as possible (--speed 0), optionally copied --channels times
+# over fresh channel and author ids. rolls are seeded per game so runs are repeatable.
+# reports latency, errors and how replies differ from --expect (a capture or a
+# previous --out of this script)
+#
+#   python benchmarks/replay.py session.jsonl [--db snapshot.db] [--speed 0] [--channels 20] [--out run.jsonl] [--expect run.jsonl]
+
+import argparse
+import asyncio
+import difflib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+from harness import Harness, percentile
+
+
+def load(path):
+	messages = []
+	replies = {}
+	with open(path) as f:
+		for line in f:
+			entry = json.loads(line)
+			if "reply_to" in entry:
+				replies.setdefault(entry["reply_to"],[]).append(entry["content"])
+			else:
+				messages.append(entry)
+	return messages, replies
+
+
+# stands in for the bot's Recorder so replies are compared before the outbox merges or splits them
+class ReplyLog():
+	def __init__(self):
+		self.replies = {}
+
+	def message(self,m):
+		pass
+
+	def reply(self,m,content):
+		self.replies.setdefault(m.id,[]).append(str(content))
+
+
+# copies of a channel get fresh negative ids for their channel and authors, so they
+# can't collide with recorded ids and still fit sqlite integers
+def remap(ids,copy,kind,id):
+	if not copy:
+		return id
+	return ids.setdefault((copy,kind,id),-len(ids)-1)
+
+
+async def play(h,messages,copy,speed,start,t0,latencies,ids):
+	for e in messages:
+		if speed:
+			delay = start+(e["t"]-t0)/speed-time.monotonic()
+			if delay > 0:
+				await asyncio.sleep(delay)
+		author = remap(ids,copy,"author",e["author"])
+		channel = remap(ids,copy,"channel",e["channel"])
+		latencies.append(await h.send(e["content"],author,channel,e["guild"],(copy,e["id"])))
+
+
+async def replay(args):
+	messages, captured = load(args.capture)
+	expected = load(args.expect)[1] if args.expect else captured
+
+	path = None
+	if args.db:
+		tmp = tempfile.mkdtemp()
+		path = shutil.copy(args.db,os.path.join(tmp,"replay.db"))
+
+	h = Harness(path)
+	h.bot.set_seed(args.seed)
+	log = h.bot.recorder = ReplyLog()
+
+	channels = {}
+	for e in messages:
+		channels.setdefault((e["guild"],e["channel"]),[]).append(e)
+
+	latencies = []
+	ids = {}
+	t0 = messages[0]["t"] if messages else 0
+	start = time.monotonic()
+	try:
+		await asyncio.gather(*[play(h,msgs,copy,args.speed,start,t0,latencies,ids) for copy in range(args.channels) for msgs in channels.values()])
+		elapsed = time.monotonic()-start
+		await h.drain()
+	finally:
+		h.close()
+		if path:
+			shutil.rmtree(os.path.dirname(path))
+
+	sent = [r for replies in log.replies.values() for r in replies]
+	diffs = []
+	for e in messages:
+		got = '\n\n'.join(log.replies.get((0,e["id"]),[]))
+		want = '\n\n'.join(expected.get(e["id"],[]))
+		if got != want:
+			diffs.append((e,list(difflib.unified_diff(want.split('\n'),got.split('\n'),"expected","replayed",lineterm=''))))
+
+	print(f"messages   {len(latencies)} over {len(channels)*args.channels} channels in {elapsed:.2f}s ({len(latencies)/elapsed:.0f}/s)")
+	print(f"latency    p50 {percentile(latencies,0.5)*1000:.3f}ms  p99 {percentile(latencies,0.99)*1000:.3f}ms  max {max(latencies,default=0)*1000:.3f}ms")
+	print(f"errors     {sum(1 for r in sent if r.startswith('ERROR: '))}  rejected {sum(1 for r in sent if r.startswith('Hold up: '))}")
+	print(f"diffs      {len(diffs)} of {len(messages)} replies differ")
+	for e,diff in diffs[:args.show]:
+		print(f"\n--- {e['content']!r} (message {e['id']})")
+		print('\n'.join(diff[2:]))
+
+	if args.out:
+		with open(args.out,"w") as f:
+			for e in messages:
+				f.write(json.dumps(e)+"\n")
+				for r in log.replies.get((0,e["id"]),[]):
+					f.write(json.dumps({"reply_to": e["id"], "content": r})+"\n")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("capture")
+	parser.add_argument("--db",help="sqlite file to start from (copied, never modified)")
+	parser.add_argument("--speed",type=float,default=1)
+	parser.add_argument("--channels",type=int,default=1)
+	parser.add_argument("--seed",type=int,default=1)
+	parser.add_argument("--out")
+	parser.add_argument("--expect")
+	parser.add_argument("--show",type=int,default=5)
+	asyncio.run(replay(parser.parse_args()))
@@ -1,89 +1,194 @@
 
 import discord
 import asyncio
-import sqlite3
-import string
-import random
-import traceback
+import collections
+import contextlib
+import contextvars
+import importlib
+import signal
+import logging
+import os
+import sys
+import time
+import zlib
 
 from character import Character
 from exceptions import FeedbackError
+from storage import Storage
+from archive import Archiver, TABLES
+from router import Router
+from prefix import PrefixIndex
+from letters import LetterIds, sort_key
+from dice import Roller, DicePool
+from odds import Odds
+from sim import Simulator
+from render import RenderCache
+from outbox import Outbox
+from confirm import Confirmations
+from logs import LogPipeline
+from metrics import Metrics
+from recorder import Recorder
 import bothelp
+import migrations
 
 
 class Bot():
 	def __init__(self, debug=True):
 		self.debug = debug
-		self.confirming = None
-
-		self.commands = [
-			("+c",self.add_consequence),
-			("+m",self.add_move),
-			("+",self.plus),
-			("-c",self.del_consequence),
-			("-m",self.del_move),
-			("-",self.minus),
-			("add char",self.add_char),
-			("call",self.call),
-			("clear",self.clear),
-			("del char",self.del_char),
-			("help",self.help),
-			("new game",self.new_game),
-			("raise",self.raise_dice),
-			("rename char",self.rename_char),
-			("roll",self.roll),
-			("set char",self.set_char),
-			("view",self.view)
-		]
-
-		self.clear_commands = [
-			("cpools",self.clear_cpools),
-			("dpools",self.clear_dpools),
-			("pools",self.clear_pools)
-		]
-
-		self.view_commands = [
-			("chars",self.view_characters),
-			("characters",self.view_characters),
-			("char",self.view_char),
-			("cpool",self.view_cpool),
-			("dpools",self.view_dpools),
-			("dpool",self.view_dpool),
-			("moves",self.view_moves),
-			("sheet",self.view_char),
-		]
-		
+		self.logs = LogPipeline(level=logging.DEBUG if debug else logging.INFO)
+		# DOGSBOT_LOG_SAMPLE sets how much of each guild's info logging is kept, see GuildSampler.configure
+		self.logs.sampler.configure(os.environ.get("DOGSBOT_LOG_SAMPLE",""))
+		self.logger = self.logs.logger
+		self.metrics = Metrics()
+		self.metrics_task = None
+		self.checkpoint_task = None
+		self.archiver = None
+		self.archive_task = None
+		self.confirmations = Confirmations()
+		self.game_locks = collections.defaultdict(asyncio.Lock)
+		self.db = None
+		self.cache = {}
+		self.players = {}
+		self.char_ids = {}
+		self.roller = Roller()
+		self.odds = Odds(max_dice=self.roller.max_listed)
+		# its worker processes also count the odds for pools too big to do on the event loop
+		self.simulator = Simulator(max_trials=100000)
+		self.seed = None
+		self.rollers = {}
+		self.recorder = None
+		self.batch = contextvars.ContextVar("batch",default=None)
+		self.renders = RenderCache()
+		self.outbox = Outbox(lambda e: self.log(e, logging.WARNING))
+		self.version = 0
+		self.game_versions = {}
+		self.name_versions = {}
+		self.owner_id = None
+		self.setup_router()
+
 		if not debug:
 			self.setup_db()
 			self.setup_discord()
+			if os.environ.get("DOGSBOT_RECORD"):
+				self.recorder = Recorder(os.environ["DOGSBOT_RECORD"])
 
 	# PROPERTIES
 
-	@property
-	def characters(self):
-		cur = self.db.execute("SELECT rowid,name,char_id FROM characters WHERE active = 1 ORDER BY char_id")
-		chars = cur.fetchall()
-		cur.close()
-		return [Character(self,c[1],c[0]) for c in chars]
+	# active characters in one game, keyed by rowid
+	def roster(self,game):
+		return self.cache.setdefault(game,{})
 
-	# SETUP
+	# new version for a character that's about to change, which also marks its game as
+	# changed. names for changes to what can be looked up by name in the game
+	def bump(self,game,names=False):
+		self.version += 1
+		self.game_versions[game] = self.version
+		if names:
+			self.name_versions[game] = self.version
+		return self.version
 
-	def setup_db(self):
-		con = self.db = sqlite3.connect("db.db")
-		schema = {
-			"characters (name text, active int, char_id text, player_id text, dice_pool text)",
-			"moves (char_id text, character_id int, dice text, name text, used int)",
-			"consequences (char_id text, character_id int, dice text, name text)"
-		}
+	def characters(self,game):
+		return sorted(self.roster(game).values(), key=lambda c:sort_key(c.char_id))
 
-		for t in schema:
-			try:
-				con.execute("CREATE TABLE IF NOT EXISTS "+t)
-			except Exception as e:
-				self.log("Error with SQL:\n"+t+"\n"+str(e))
-				break
+	# SETUP
 
-		con.commit()
+	def setup_router(self):
+		self.router = Router([
+			("+c {consequence}",self.add_consequence),
+			("+m {move}",self.add_move),
+			("+ {dice:dice}",self.plus_dice),
+			("+ {n:int}",self.plus_int),
+			("+ {indicator}",self.plus_move),
+			("-c {indicator}",self.del_consequence),
+			("-m {indicator}",self.del_move),
+			("- {values}",self.minus),
+			("add char {name}",self.add_char),
+			("call {values}",self.call),
+			("clear cpools",self.clear_cpools),
+			("clear dpools",self.clear_dpools),
+			("clear pools",self.clear_pools),
+			("clear",self.clear),
+			("clear {what}",self.clear),
+			("claim old chars",self.claim_old),
+			("del char",self.del_char),
+			("help",self.help),
+			("import",self.import_sheet),
+			("import\n{sheet}",self.import_sheet),
+			("history",self.history),
+			("history {n:int}",self.history),
+			("help {topic}",self.help),
+			("new game {names}",self.new_game),
+			("odds cs",self.odds_consequences),
+			("odds cs {n:int}",self.odds_consequences),
+			("odds {pool:pool}",self.odds_dice),
+			("odds {pool:pool} {n:int}",self.odds_dice),
+			("odds {indicator:word} {n:int}",self.odds_move),
+			("odds {indicator}",self.odds_move),
+			("raise {values}",self.raise_dice),
+			("reload",self.reload_command),
+			("rename char {name}",self.rename_char),
+			("restore char {name}",self.restore_char),
+			("roll cs",self.roll_consequences),
+			("roll {dice:dice}",self.roll_dice),
+			("roll {indicator}",self.roll_move),
+			("set char {indicator}",self.set_char),
+			("sim {a:word} {b:word}",self.sim),
+			("sim {a:word} {b:word} {trials:int}",self.sim),
+			("sim {a:word} {b:word} {trials:int} {strategy:word}",self.sim),
+			("stats",self.stats),
+			("undo",self.undo),
+			("view",self.view_char),
+			("view chars",self.view_characters),
+			("view characters",self.view_characters),
+			("view char",self.view_char),
+			("view cpool",self.view_cpool),
+			("view dpools",self.view_dpools),
+			("view dpool",self.view_dpool),
+			("view moves",self.view_moves),
+			("view sheet",self.view_char),
+			("view {indicator}",self.view_char)
+		])
+
+	# DOGSBOT_DB_PROFILE picks the sqlite settings, see storage.profiles
+	def setup_db(self,path="db.db",profile=None):
+		self.db = Storage(path,metrics=self.metrics,profile=profile or os.environ.get("DOGSBOT_DB_PROFILE","durable"))
+		self.db.check()
+		self.db.run(migrations.migrate)
+		self.db.load_rowids([(t,"archive_"+t) for t in TABLES])
+		self.archiver = Archiver(self.db)
+		self.load_characters()
+
+	# read every active character + their moves and consequences into the cache once
+	def load_characters(self):
+		self.cache = {}
+		self.players = {}
+		self.char_ids = {}
+
+		chars = {}
+		for row in self.db.query("SELECT rowid,name,char_id,player_id,dice_pool,game_id,journal_id FROM characters WHERE active = 1"):
+			c = Character(self,row[1],row[0],row[5])
+			c.load(row[2],row[3],row[4],row[6])
+			chars[row[0]] = self.roster(c.game)[row[0]] = c
+			if row[3]:
+				self.players[(c.game,row[3])] = c
+
+		for row in self.db.query("SELECT m.character_id,m.char_id,m.dice,m.name,m.used,m.rowid FROM moves m JOIN characters c ON c.rowid = m.character_id WHERE c.active = 1 ORDER BY m.char_id"):
+			if row[0] in chars:
+				chars[row[0]]._moves.append(row[1:])
+
+		for row in self.db.query("SELECT q.character_id,q.char_id,q.dice,q.name,q.rowid FROM consequences q JOIN characters c ON c.rowid = q.character_id WHERE c.active = 1 ORDER BY q.char_id"):
+			if row[0] in chars:
+				chars[row[0]]._consequences.append(row[1:])
+
+		# sql sorts AA before B, so put letter ids in the order they're handed out
+		for c in chars.values():
+			c._moves.sort(key=lambda r:sort_key(r[0]))
+			c._consequences.sort(key=lambda r:sort_key(r[0]))
+
+		# pools are snapshots, so bring them up to date with what was journaled since
+		for row in self.db.query("SELECT j.character_id,j.id,j.added,j.removed FROM journal j JOIN characters c ON c.id = j.character_id WHERE c.active = 1 AND j.id > c.journal_id ORDER BY j.id"):
+			if row[0] in chars:
+				chars[row[0]].replay(*row[1:])
 
 	def setup_discord(self):
 		intents = discord.Intents.default()
@@ -93,37 +198,98 @@ class Bot():
 	def start_bot(self,token):
 		self.client.run(token)
 
+	# re-import the command modules and move this bot and its cached characters onto the
+	# new classes. the client, database, caches, outbox and confirmations are kept as is,
+	# so nothing reconnects
+	def reload(self):
+		character = importlib.reload(sys.modules["character"])
+		importlib.reload(sys.modules["bothelp"])
+		module = importlib.reload(sys.modules[type(self).__module__])
+
+		self.__class__ = module.Bot
+		for roster in self.cache.values():
+			for c in roster.values():
+				c.__class__ = character.Character
+		self.setup_router()
+		self.renders.clear()
+		self.log("reloaded command handlers")
+
+	def on_hangup(self):
+		try:
+			self.reload()
+		except Exception:
+			self.logger.exception("reload failed")
+
 	# UTIL
 
-	def log(self, m):
-		print(m)
+	def log(self, m, level=logging.INFO, **fields):
+		self.logger.log(level, m, extra={"fields": fields})
 
 	def debug_log(self, m):
 		if self.debug:
 			self.log(m)
 
-	def get_next_char_id(self, table="characters", character_id=None):
-		chars = string.ascii_uppercase+string.ascii_lowercase
-
+	# queue a reply; the outbox paces, merges and splits them per channel. during a
+	# command they wait in its unit, so nothing is said about writes that then fail
+	def reply(self, m, content):
+		replies = self.batch.get()
+		if replies is not None:
+			replies.append(str(content))
+			return
+		unit = self.db.unit.get() if self.db else None
+		if unit is not None:
+			unit.replies.append((m,content))
+			return
+		self.send(m, content)
+
+	def send(self, m, content):
+		if self.recorder:
+			self.recorder.reply(m, content)
+		self.outbox.send(m, content)
+
+	def is_gm(self,m):
+		perms = getattr(m.author,"guild_permissions",None)
+		return bool(perms and (perms.manage_guild or perms.administrator))
+
+	def game_key(self,m):
+		if m.guild:
+			return f"{m.guild.id}:{m.channel.id}"
+		return f"dm:{m.channel.id}"
+
+	# letter ids taken in a game's roster, rebuilt from the cache when missing: at
+	# startup and after a rolled back command
+	def letter_ids(self,game):
+		if game not in self.char_ids:
+			self.char_ids[game] = LetterIds(c._char_id for c in self.roster(game).values())
+		return self.char_ids[game]
+
+	def get_next_char_id(self, table="characters", character_id=None, game=None):
 		if table == "characters":
-			cur = self.db.execute("SELECT char_id FROM characters WHERE active = 1 ORDER BY char_id")
-		if table == "consequences":
-			cur = self.db.execute("SELECT char_id FROM consequences WHERE character_id = ? ORDER BY char_id", [character_id])
-		if table == "moves":
-			cur = self.db.execute("SELECT char_id FROM moves WHERE character_id = ? ORDER BY char_id", [character_id])
-		
-		char_ids = [c[0] for c in cur.fetchall()]
-		cur.close()
-		
-		for char in chars:
-			if char not in char_ids:
-				return char
-		
-		raise FeedbackError("Too many active "+table+"!")
+			return self.letter_ids(game).take()
+		return self.roster(game)[character_id].letter_ids(table).take()
+
 
+	# one commit per command; on failure nothing is written, nothing is replied and the
+	# cache is put back
+	@contextlib.asynccontextmanager
+	async def transaction(self):
+		if not self.db:
+			yield
+			return
+
+		try:
+			async with self.db.transaction() as unit:
+				yield
+		except Exception:
+			self.players = {(c.game,c.player): c for r in self.cache.values() for c in r.values() if c.player}
+			self.char_ids = {}
+			raise
 
-	def get_player_char(self,pid):
-		c = next((char for char in self.characters if char.player and int(char.player) == int(pid)),None)
+		for m,content in unit.replies:
+			self.send(m, content)
+
+	def get_player_char(self,m):
+		c = self.players.get((self.game_key(m),str(m.author.id)))
 
 		if c:
 			return c
@@ -143,170 +309,209 @@ class Bot():
 
 		return amt, die
 
-	def r(self,amt,die):
-		return sorted([random.randint(1,die) for i in range(amt)], key=lambda x:0-x)
+	# "3d6+2d8" as [(3, 6), (2, 8)]
+	def parse_pool(self, pool):
+		return [self.parse_dice(d) for d in pool.split('+')]
 
+	# with a seed set, every game rolls from its own generator so a replay comes out the
+	# same no matter how the games interleave
+	def set_seed(self,seed):
+		self.seed = seed
+		self.rollers = {}
 
-	def select_char(self,indicator):
-		if len(indicator) == 1:
-			c = next((char for char in self.characters if char.char_id == indicator), None)
-		else:
-			c = next((char for char in self.characters if char.name.lower().startswith(indicator.lower())), None)
+	def roller_for(self,game):
+		if self.seed is None:
+			return self.roller
+		if game not in self.rollers:
+			self.rollers[game] = Roller(self.seed*1000003+zlib.crc32(str(game).encode()),self.roller.max_listed,self.roller.max_dice)
+		return self.rollers[game]
 
-		if c:
-			return c
-		
-		raise FeedbackError("Couldn't find that character")
+	def r(self,amt,die,game=None):
+		return self.roller_for(game).roll(amt,die)
+
+
+	# the game's names as a prefix index, rebuilt when characters are added, renamed or go,
+	# not on every dice change
+	def char_index(self,game):
+		return self.renders.get(("char index",game,self.name_versions.get(game)),lambda: PrefixIndex([(c.char_id,c.name,c) for c in self.roster(game).values()]))
+
+	def select_char(self,game,indicator):
+		return self.char_index(game).find(indicator,"character")
 
 	# EVENTS
 
 	async def on_ready(self):
 		self.log('DOGSbot ready')
+		if self.owner_id is None:
+			self.owner_id = (await self.client.application_info()).owner.id
+		# kill -HUP reloads the command handlers, same as dq reload
+		if hasattr(signal,"SIGHUP"):
+			asyncio.get_running_loop().add_signal_handler(signal.SIGHUP,self.on_hangup)
+		if not self.metrics_task:
+			self.metrics_task = asyncio.create_task(self.metrics.export_every("metrics.prom"))
+		if not self.checkpoint_task and self.db.profile.checkpoint_idle:
+			self.checkpoint_task = asyncio.create_task(self.db.checkpoint_when_idle())
+		if not self.archive_task:
+			self.archive_task = asyncio.create_task(self.archiver.run_every())
 
 	async def on_message(self,m):
+		# most of what the bot sees is chatter, so drop that before doing anything else
 		if m.author.bot:
 			return
+		if not m.content.startswith('dq ') and m.author.id not in self.confirmations:
+			return
+
+		if self.recorder:
+			self.recorder.message(m)
 
-		self.log('got a message: '+m.content)
+		guild = m.guild.id if m.guild else None
+		if self.logger.isEnabledFor(logging.INFO):
+			self.logger.info("command", extra={"guild": guild, "fields": {"guild": guild, "channel": m.channel.id, "author": m.author.id, "content": m.content}})
 
 		try:
-			if m.content.startswith('dq '):
-				await self.parse_command(m)
-			elif m.content.startswith('Y') and self.confirming:
-				await self.confirm(m)
-			elif m.content.lower().startswith('n') and self.confirming:
-				await self.deny(m)
+			# one command at a time per game: a rollback puts back how the game's characters
+			# looked when the command started, which is only right if nothing else changed them since
+			async with self.game_locks[self.game_key(m)], self.transaction():
+				if m.content.startswith('dq '):
+					await self.run_commands(m)
+				elif m.author.id in self.confirmations:
+					if m.content.startswith('Y'):
+						await self.confirm(m)
+					elif m.content.lower().startswith('n'):
+						await self.deny(m)
 
 		except FeedbackError as e:
-			await m.reply(f"Hold up: {e}", mention_author=False)
+			self.reply(m, f"Hold up: {e}")
 
 		except Exception as e:
-			self.log(traceback.format_exc())
-			await m.reply(f"ERROR: {e}", mention_author=False)
+			self.logger.exception("command failed", extra={"guild": guild, "fields": {"guild": guild, "channel": m.channel.id, "content": m.content}})
+			self.reply(m, f"ERROR: {e}")
 
 
 	# COMMAND PARSING
 
-	async def parse_command(self,m):
-		for command,method in self.commands:
-			if m.content[3:].startswith(command):
-				await method(m)
-				return
-
-	async def view(self,m):
-		for command,method in self.view_commands:
-			if m.content[8:] == command:
-				await method(m)
-				return
-		await self.view_char(m,select=True)
-
-	# assuming del char only for these two
-	async def confirm(self,m):
-		if m.author.id != self.confirming[1]:
+	# a message can hold several commands, each on a line starting with dq (other lines
+	# carry on the one above). they share the message's transaction, so all of them land
+	# or none do, and their replies go out as one
+	async def run_commands(self,m):
+		commands = []
+		for line in m.content.split('\n'):
+			if line.startswith('dq ') or not commands:
+				commands.append(line)
+			else:
+				commands[-1] += '\n'+line
+
+		if len(commands) == 1:
+			await self.parse_command(m,commands[0][3:])
 			return
-		self.confirming[0]()
-		self.confirming = None
-		await m.reply("Okay, done!", mention_author=False)
 
-	async def deny(self,m):
-		if m.author.id != self.confirming[1]:
-			return
-		self.confirming = None
-		await m.reply("Okay, nevermind!", mention_author=False)
-
-	async def clear(self,m):
-		for command,method in self.clear_commands:
-			if m.content[9:] == command:
-				await method(m)
-				return
-		raise FeedbackError("Clear what? (dpools/cpools/pools)")
-
-
-	async def plus(self,m):
-		d = None
+		replies = []
+		token = self.batch.set(replies)
 		try:
-			d = self.parse_dice(m.content[5:])
-		except FeedbackError:
-			pass
-
-		if d:
-			await self.plus_dice(m,d)
-			return
-
+			for n,command in enumerate(commands,1):
+				try:
+					if not await self.parse_command(m,command[3:]):
+						raise FeedbackError("I don't know that command.")
+				except FeedbackError as e:
+					raise FeedbackError(f"line {n} (`{command.split(chr(10))[0]}`): {e}\nNothing from that message was done.")
+		finally:
+			self.batch.reset(token)
+
+		self.reply(m, "\n\n".join(replies))
+
+	# for commands that read from the db, which only has what's been committed: in a
+	# batch, once lines above have changed something, what they'd see is out of date
+	def check_committed(self,command):
+		unit = self.db.unit.get()
+		if self.batch.get() is not None and unit is not None and unit.statements:
+			raise FeedbackError(f"`dq {command}` can't see what the lines above it just did. Send it on its own, or before them.")
+
+	async def parse_command(self,m,text):
+		route = self.router.resolve(text)
+		if not route:
+			return False
+
+		method, args = route
+		unit = self.db.unit.get() if self.db else None
+		before = len(unit.statements)+unit.reads if unit else 0
+		start = time.perf_counter()
 		try:
-			d = int(m.content[5:])
-		except:
-			pass
-
-		if d:
-			await self.plus_int(m,d)
-			return
+			await method(m,**args)
+		finally:
+			self.metrics.observe(method.__name__, time.perf_counter()-start, len(unit.statements)+unit.reads-before if unit else 0)
+		return True
 
-		await self.plus_move(m)
-
-
-	async def roll(self,m):
-		if m.content[8:] == 'cs':
-			await self.roll_consequences(m)
+	# assuming del char only for these two
+	async def confirm(self,m):
+		action = self.confirmations.take(self.game_key(m),m.author.id)
+		if not action:
 			return
+		if not action():
+			raise FeedbackError("That character's already been deleted.")
+		self.reply(m, "Okay, done!")
 
-		d = None
-		try:
-			d = self.parse_dice(m.content[8:])
-		except FeedbackError:
-			pass
-		
-		if d:
-			await self.roll_dice(m,d)
+	async def deny(self,m):
+		if not self.confirmations.take(self.game_key(m),m.author.id):
 			return
+		self.reply(m, "Okay, nevermind!")
 
-		await self.roll_move(m)
+	async def clear(self,m,what=None):
+		raise FeedbackError("Clear what? (dpools/cpools/pools)")
 
 
 	# RESPONSE FORMATTING
 	
 	# select active chars + print them in order of char_id
-	@property
-	def char_list(self):
-		return "```js\n_\nCharacters:\n"+"\n".join([f"   {c.char_id} - {c.name}" for c in self.characters])+"\n```"
+	def char_list(self,game):
+		return self.renders.get(("chars",game,self.game_versions.get(game)),lambda: "```js\n_\nCharacters:\n"+"\n".join([f"   {c.char_id} - {c.name}" for c in self.characters(game)])+"\n```")
+
+	# the chance of n or more for each count, or a spread of thresholds without n
+	def odds_list(self,odds,name,n=None,rows=6):
+		if n is not None:
+			return f"   {n}+: {odds.at_least(name,n):.1%}"
+
+		values = [v for v in odds.values(name) if 0.001 <= odds.at_least(name,v) <= 0.999] or odds.values(name)[-1:]
+		step = -(-len(values)//rows)
+		return "\n".join(f"   {v}+: {odds.at_least(name,v):.1%}" for v in values[::step])
+
+	def odds_reply(self,m,title,odds,n=None,sums=True):
+		reply = [f"Odds for {title}:","```js"]
+		if sums:
+			reply += [f"Sum (average {odds.mean('sums'):.1f}):",self.odds_list(odds,'sums',n),'']
+		reply += [f"Top two (average {odds.mean('top_two'):.1f}):",self.odds_list(odds,'top_two',n),'']
+		reply += [f"At least one one: {odds.at_least('ones',1):.1%}","```"]
+		self.reply(m, "\n".join(reply))
 
 	# COMMANDS
 
-	async def add_char(self,m):
-		name = m.content[12:]
-		char = Character(self, name)
-		await m.reply(f"Added {name} ({char.char_id}) to the game!\n\n{self.char_list}", mention_author=False)
+	async def add_char(self,m,name):
+		game = self.game_key(m)
+		char = Character(self, name, game=game)
+		self.reply(m, f"Added {name} ({char.char_id}) to the game!\n\n{self.char_list(game)}")
 
 
-	async def add_consequence(self,m):
-		char = self.get_player_char(m.author.id)
-		char.add_consequence(m.content[6:])
-		await m.reply(f"Added!\n\n{char.print_list(char.consequence_list,'Consequences')}", mention_author=False)
+	async def add_consequence(self,m,consequence):
+		char = self.get_player_char(m)
+		char.add_consequence(consequence)
+		self.reply(m, f"Added!\n\n{char.print_list(char.consequence_list,'Consequences')}")
 
 
-	async def add_move(self,m):
-		char = self.get_player_char(m.author.id)
-		char.add_move(m.content[6:])
-		await m.reply(f"Added!\n\n{char.print_list(char.move_list,'Moves')}", mention_author=False)
+	async def add_move(self,m,move):
+		char = self.get_player_char(m)
+		char.add_move(move)
+		self.reply(m, f"Added!\n\n{char.print_list(char.move_list,'Moves')}")
 
 
-	async def call(self,m):
-		char = self.get_player_char(m.author.id)
-		dice = m.content[8:].split(' ')
+	async def call(self,m,values):
+		char = self.get_player_char(m)
+		dice = values.split(' ')
 		
 		try:
 			test = [int(d) for d in dice]
 		except:
 			raise FeedbackError("Invalid values. Syntax is, for example, `dq call 4 5`.")
 
-		cdice = char.dice
-		try:
-			for d in dice:
-				cdice.remove(d)
-		except:
-			raise FeedbackError("You don't have those values in your dice pool!")
-
-		char.dice = cdice
+		char.remove_dice(test,"called")
 		vstring = str(sum(test))
 
 		if len(dice) < 2:
@@ -318,121 +523,213 @@ class Bot():
 
 		reply = f"```js\n{reply}\n\nDicePool:\n{char.dice_list}```"
 
-		await m.reply(reply, mention_author=False)
+		self.reply(m, reply)
+
+
+	# characters from before games were per channel have no game, so no channel can see
+	# them until a GM brings them, and the archived ones, into theirs
+	async def claim_old(self,m):
+		if not self.is_gm(m):
+			raise FeedbackError("Only GMs (Manage Server) can claim old characters.")
+
+		rows = await self.db.read("SELECT (SELECT COUNT(*) FROM characters WHERE game_id IS NULL)+(SELECT COUNT(*) FROM archive_characters WHERE game_id IS NULL)")
+		chars = self.characters(None)
+		if not chars and not rows[0][0]:
+			raise FeedbackError("There are no characters from before games were per channel.")
+
+		game = self.game_key(m)
+		for c in chars:
+			c.adopt(game)
+		self.db.write_many([(f"UPDATE {t} SET game_id = ? WHERE game_id IS NULL",[game]) for t in ["characters","archive_characters"]])
+
+		self.reply(m, f"Claimed {len(chars)} character{'' if len(chars) == 1 else 's'} from before games were per channel. Archived ones can be brought back with `dq restore char`.\n\n{self.char_list(game)}")
 
 
 	async def clear_cpools(self,m):
-		for c in self.characters:
+		for c in self.characters(self.game_key(m)):
 			c.clear_consequences()
-		await m.reply("Cleared all consequence pools!", mention_author=False)
+		self.reply(m, "Cleared all consequence pools!")
 
 
 	async def clear_dpools(self,m):
-		for c in self.characters:
-			c.dice = []
+		for c in self.characters(self.game_key(m)):
+			c.clear_dice()
 			c.reset_moves()
 
-		await m.reply("Cleared all dice pools and reset moves!", mention_author=False)
+		self.reply(m, "Cleared all dice pools and reset moves!")
 
 
 	async def clear_pools(self,m):
-		for c in self.characters:
+		for c in self.characters(self.game_key(m)):
 			c.clear_consequences()
-			c.dice = []
+			c.clear_dice()
 			c.reset_moves()
 
-		await m.reply("Cleared all dice and consequence pools and reset moves!", mention_author=False)
+		self.reply(m, "Cleared all dice and consequence pools and reset moves!")
 
 
 	async def del_char(self,m):
-		char = self.get_player_char(m.author.id)
-		self.confirming = (char.archive,m.author.id)
+		char = self.get_player_char(m)
+		self.confirmations.add(self.game_key(m),m.author.id,char.archive)
 
-		await m.reply(f"Deleting {char.name}. Are you sure? (Y/n)", mention_author=False)
+		self.reply(m, f"Deleting {char.name}. Are you sure? (Y/n)")
 
 
-	async def del_consequence(self,m):
-		char = self.get_player_char(m.author.id)
-		char.del_consequence(m.content[6:])
-		await m.reply(f"Deleted consequence!\n{char.print_list(char.consequence_list,'Consequences')}", mention_author=False)
+	async def del_consequence(self,m,indicator):
+		char = self.get_player_char(m)
+		char.del_consequence(indicator)
+		self.reply(m, f"Deleted consequence!\n{char.print_list(char.consequence_list,'Consequences')}")
 
 
-	async def del_move(self,m):
-		char = self.get_player_char(m.author.id)
-		char.del_move(m.content[6:])
-		await m.reply(f"Deleted move!\n{char.print_list(char.move_list,'Moves')}", mention_author=False)
+	async def del_move(self,m,indicator):
+		char = self.get_player_char(m)
+		char.del_move(indicator)
+		self.reply(m, f"Deleted move!\n{char.print_list(char.move_list,'Moves')}")
 
 
-	async def minus(self,m):
-		char = self.get_player_char(m.author.id)
-		dice = m.content[5:].split(' ')
+	async def minus(self,m,values):
+		char = self.get_player_char(m)
+		dice = values.split(' ')
 		
 		try:
 			test = [int(d) for d in dice]
 		except:
 			raise FeedbackError("Invalid values. Syntax is, for example, `dq - 4 5`.")
 
-		cdice = char.dice
-		try:
-			for d in dice:
-				cdice.remove(d)
-		except:
-			raise FeedbackError("You don't have those values in your dice pool!")
-
-		char.dice = cdice
+		char.remove_dice(test)
+
+		self.reply(m, f"Removed!\n\n{char.print_list(char.dice_list,'DicePool')}")
+
+
+	async def history(self,m,n=10):
+		self.check_committed("history")
+		char = self.get_player_char(m)
+		rows = await char.history(max(1,min(int(n),50)))
+
+		lines = []
+		for kind,added,removed,detail,undone in reversed(rows):
+			line = f"{'//' if undone else '  '} {kind}" + (f" {detail}" if detail else '')
+			if added:
+				line += " +" + ", ".join(str(d) for d in DicePool.decode(added))
+			if removed:
+				line += " -" + ", ".join(str(d) for d in DicePool.decode(removed))
+			lines.append(line)
+
+		self.reply(m, char.print_list("\n".join(lines) or "   [empty]","History"))
+
+
+	# a whole roster in one go: each character's name on a line, followed by lines of
+	# their moves and consequences as +m [dice] [name] and +c [dice] [name]
+	async def import_sheet(self,m,sheet=None):
+		sheets = []
+		for n,line in enumerate((sheet or '').split('\n'),1):
+			line = line.strip()
+			if line.startswith(('+m ','+c ')):
+				if not sheets:
+					raise FeedbackError(f"Line {n}: put the character's name before their moves and consequences.")
+				sheets[-1][1 if line.startswith('+m') else 2].append(line[3:].strip())
+			elif line:
+				sheets.append((line,[],[]))
+
+		if not sheets:
+			raise FeedbackError("Nothing to import! Put each character's name on its own line after `dq import`, followed by their `+m [dice] [name]` and `+c [dice] [name]` lines.")
+
+		# characters, then moves, then consequences, so each table's rows go in as one bulk insert
+		game = self.game_key(m)
+		chars = [Character(self,name,game=game) for name,moves,cqs in sheets]
+		for kind in [1,2]:
+			for c,s in zip(chars,sheets):
+				for line in s[kind]:
+					try:
+						if kind == 1:
+							c.add_move(line)
+						else:
+							c.add_consequence(line,journal=False)
+					except FeedbackError as e:
+						raise FeedbackError(f"{c.name}, `{line}`: {e}")
+
+		# consequences are journaled after the inserts so those stay one bulk insert per
+		# table, and show in dq history and can be undone like ones added with dq +c
+		for c in chars:
+			for cq in c.consequences:
+				c.journal("consequence added",ref=cq[3],detail=f"{cq[1]} {cq[2]}")
 
-		await m.reply(f"Removed!\n\n{char.print_list(char.dice_list,'DicePool')}", mention_author=False)
+		self.reply(m, f"Imported {len(chars)} character{'s' if len(chars) > 1 else ''}!\n\n{self.char_list(game)}")
 
 
-	async def new_game(self,m):
-		char_names = m.content[12:].split(',')
+	async def new_game(self,m,names):
+		char_names = names.split(',')
+		game = self.game_key(m)
 		
-		for c in self.characters:
+		for c in self.characters(game):
 			c.archive()
 		for n in char_names:
-			c = Character(self,n.strip())
+			c = Character(self,n.strip(),game=game)
+
+		self.reply(m, f"New game started with new characters!\n\n{self.char_list(game)}")
+
+
+	async def odds_consequences(self,m,n=None):
+		char = self.get_player_char(m)
+		cqs = char.consequences
+
+		if len(cqs) < 1:
+			raise FeedbackError("There are no consequences in your pool!")
+
+		odds = await self.odds.pool([self.parse_dice(c[1]) for c in cqs],self.simulator.executor())
+		self.odds_reply(m, "your consequence pool", odds, None if n is None else int(n), sums=False)
 
-		await m.reply(f"New game started with new characters!\n\n{self.char_list}", mention_author=False)
 
+	async def odds_dice(self,m,pool,n=None):
+		odds = await self.odds.pool(self.parse_pool(pool),self.simulator.executor())
+		self.odds_reply(m, pool, odds, None if n is None else int(n))
 
-	async def plus_dice(self,m,d):
-		amt, die = d
-		rolls = [str(r) for r in self.r(amt,die)]
+
+	async def odds_move(self,m,indicator,n=None):
+		char = self.get_player_char(m)
+		move = char.select_move(indicator)
+
+		odds = await self.odds.pool([self.parse_dice(move[1])],self.simulator.executor())
+		self.odds_reply(m, f"{move[2]} ({move[1]})", odds, None if n is None else int(n))
+
+
+	async def plus_dice(self,m,dice):
+		amt, die = self.parse_dice(dice)
+		rolls = self.r(amt,die,self.game_key(m))
 		
-		char = self.get_player_char(m.author.id)
-		char.dice += rolls
+		char = self.get_player_char(m)
+		char.add_dice(rolls,"rolled",f"{amt}d{die}")
 
-		await m.reply(f"Rolled {amt}d{die}:\n`{', '.join(rolls)}`\n\n{char.print_list(char.dice_list,'DicePool')}", mention_author=False)
+		self.reply(m, f"Rolled {amt}d{die}:\n`{', '.join(str(r) for r in rolls)}`\n\n{char.print_list(char.dice_list,'DicePool')}")
 
 
 	async def plus_int(self,m,n):
-		n = str(n)
+		n = int(n)
 
-		char = self.get_player_char(m.author.id)
-		char.dice += [n]
+		char = self.get_player_char(m)
+		char.add_dice([n])
 		
-		await m.reply(f"Added {n} to your dice pool!\n\n{char.print_list(char.dice_list,'DicePool')}", mention_author=False)
+		self.reply(m, f"Added {n} to your dice pool!\n\n{char.print_list(char.dice_list,'DicePool')}")
 
 
-	async def plus_move(self,m):
-		char = self.get_player_char(m.author.id)
-		move = char.select_move(m.content[5:])
+	async def plus_move(self,m,indicator):
+		char = self.get_player_char(m)
+		move = char.select_move(indicator)
 
 		if move[3] == 1:
 			raise FeedbackError("That move has been used already!")
 
 		amt, die = self.parse_dice(move[1])
-		rolls = [str(r) for r in self.r(amt,die)]
+		rolls = self.r(amt,die,char.game)
 
-		char.dice += rolls
-		char.set_move_as_used(move)
+		char.use_move(move,rolls)
 
-		await m.reply(f"Rolled {move[2]} ({amt}d{die}):\n`{', '.join(rolls)}`\n\n{char.sheet}", mention_author=False)
+		self.reply(m, f"Rolled {move[2]} ({amt}d{die}):\n`{', '.join(str(r) for r in rolls)}`\n\n{char.sheet}")
 
 
-	async def raise_dice(self,m):
-		char = self.get_player_char(m.author.id)
-		dice = m.content[9:].split(' ')
+	async def raise_dice(self,m,values):
+		char = self.get_player_char(m)
+		dice = values.split(' ')
 		
 		try:
 			test = [int(d) for d in dice]
@@ -442,21 +739,36 @@ class Bot():
 		if len(dice) > 2:
 			raise FeedbackError("You must raise with one or two values.")
 
-		cdice = char.dice
-		try:
-			for d in dice:
-				cdice.remove(d)
-		except:
-			raise FeedbackError("You don't have those values in your dice pool!")
-
-		char.dice = cdice
+		char.remove_dice(test,"raised")
 		vstring = ' and '.join(dice)
 
-		await m.reply(f"Raised with {vstring}!\n\n{char.print_list(char.dice_list,'DicePool')}", mention_author=False)
+		self.reply(m, f"Raised with {vstring}!\n\n{char.print_list(char.dice_list,'DicePool')}")
+
+
+	# bring an archived character back into the game, from the hot table or the archive
+	async def restore_char(self,m,name):
+		self.check_committed("restore char")
+		game = self.game_key(m)
+		found = await self.archiver.find(game,name)
+		if not found:
+			raise FeedbackError("Couldn't find an archived character by that name")
+		row, moves, consequences, journal = found
+
+		c = Character(self,row[1],row[0],game)
+		c.load(self.get_next_char_id(game=game),'',row[5],row[7])
+		c._moves = sorted((r[1:] for r in moves),key=lambda r:sort_key(r[0]))
+		c._consequences = sorted((r[1:] for r in consequences),key=lambda r:sort_key(r[0]))
+		for event in journal:
+			c.replay(*event)
+		c.touch(names=True)
+		self.roster(game)[c.db_id] = c
+		self.archiver.restore(c.db_id,c.char_id)
+
+		self.reply(m, f"Restored {c.name} ({c.char_id}) to the game!\n\n{self.char_list(game)}")
 
 
 	async def roll_consequences(self,m):
-		char = self.get_player_char(m.author.id)
+		char = self.get_player_char(m)
 		cqs = char.consequences
 
 		if len(cqs) < 1:
@@ -468,9 +780,9 @@ class Bot():
 
 		for c in cqs:
 			amt, die = self.parse_dice(c[1])
-			rolls = self.r(amt,die)
-			two = sorted(rolls + two, key=lambda x:0-x)[:2]
-			ones += rolls.count(1)
+			rolls = self.r(amt,die,char.game)
+			two = self.roller.top([two,rolls])
+			ones += self.roller.ones(rolls)
 			reply += [f"{c[2]} ({amt}d{die}): {','.join([str(r) for r in rolls])}"]
 
 		reply += ['',f"{str(two[0]+two[1])} = {two[0]} + {two[1]}"]
@@ -482,80 +794,122 @@ class Bot():
 
 		char.clear_consequences()
 
-		await m.reply("\n".join(reply), mention_author = False)
+		self.reply(m, "\n".join(reply))
+
 
+	async def roll_dice(self,m,dice):
+		amt, die = self.parse_dice(dice)
 
-	async def roll_dice(self,m,d):
-		amt, die = d
+		if amt > self.roller.max_listed:
+			total, counts = self.roller_for(self.game_key(m)).summary(amt,die)
+			self.reply(m, f"Rolled {amt}d{die}:\n`{total}` ({counts[die]} {die}s, {counts[1]} ones)")
+			return
 
-		rolls = self.r(amt,die)
+		rolls = self.r(amt,die,self.game_key(m))
 		total = sum(rolls)
 		rlist = ' + '.join([str(r) for r in rolls])
 
 		reply = f"{total} = {rlist}" if len(rolls) > 1 else total
 		reply = f"Rolled {amt}d{die}:\n`{reply}`"
 
-		await m.reply(reply, mention_author=False)
+		self.reply(m, reply)
 
 
-	async def roll_move(self,m):
-		char = self.get_player_char(m.author.id)
-		move = char.select_move(m.content[8:])
+	async def roll_move(self,m,indicator):
+		char = self.get_player_char(m)
+		move = char.select_move(indicator)
 
 		if move[3] == 1:
 			raise FeedbackError("That move has been used already!")
 
 		amt, die = self.parse_dice(move[1])
-		rolls = [str(r) for r in self.r(amt,die)]
+		rolls = [str(r) for r in self.r(amt,die,char.game)]
 
-		char.set_move_as_used(move)
+		char.use_move(move)
 
-		await m.reply(f"Rolled {move[2]} ({amt}d{die}):\n`{', '.join(rolls)}`\n\n{char.print_list(char.move_list,'Moves')}", mention_author=False)
+		self.reply(m, f"Rolled {move[2]} ({amt}d{die}):\n`{', '.join(rolls)}`\n\n{char.print_list(char.move_list,'Moves')}")
 
 
-	async def rename_char(self,m):
-		char = self.get_player_char(m.author.id)
-		name = m.content[15:]
+	async def rename_char(self,m,name):
+		char = self.get_player_char(m)
 		old_name = char.name
 
 		char.rename(name)
-		await m.reply(f"Renamed {old_name} to {name}!",mention_author=False)
+		self.reply(m, f"Renamed {old_name} to {name}!")
 
 
-	async def set_char(self,m):
-		char = self.select_char(m.content[12:])
+	async def reload_command(self,m):
+		if m.author.id != self.owner_id:
+			raise FeedbackError("Only the bot owner can reload it.")
+		self.reload()
+		self.reply(m, "Reloaded!")
+
+
+	async def set_char(self,m,indicator):
+		char = self.select_char(self.game_key(m),indicator)
 		char.player = m.author.id
 
 		reply = f"You are now playing as {char.name}.\n\n"
 		reply += char.sheet
 
-		await m.reply(reply, mention_author=False)
+		self.reply(m, reply)
+
+
+	# conflicts between two characters' unused moves, simulated in worker processes
+	async def sim(self,m,a,b,trials=10000,strategy="fewest"):
+		game = self.game_key(m)
+		chars = [self.select_char(game,a),self.select_char(game,b)]
+		dice = [[self.parse_dice(move[1]) for move in c.moves if not move[3]] for c in chars]
+
+		result = await self.simulator.run(asyncio.get_running_loop(),*dice,int(trials),strategy)
+
+		reply = [f"Simulated {trials} conflicts, {chars[0].name} raising first ({strategy}):","```js"]
+		for side,c in enumerate(chars):
+			reply += [f"{c.name} wins {result.win_rate(side):.1%}",f"   Consequence dice: {result.mean_taken(side):.2f} on average"]
+			reply += ["   "+", ".join(f"{n}: {p:.1%}" for n,p in result.taken_odds(side)),'']
+		reply[-1] = "```"
+
+		self.reply(m, "\n".join(reply))
+
+
+	async def stats(self,m):
+		if not self.is_gm(m):
+			raise FeedbackError("Only GMs (Manage Server) can view stats.")
+		self.reply(m, f"```js\n{self.metrics.summary()}\n```")
+
+
+	async def undo(self,m):
+		self.check_committed("undo")
+		char = self.get_player_char(m)
+		kind, detail = await char.undo()
+
+		self.reply(m, f"Undid {kind}{' '+detail if detail else ''}!\n\n{char.sheet}")
 
 
 	async def view_characters(self,m):
-		await m.reply(self.char_list, mention_author=False)
+		self.reply(m, self.char_list(self.game_key(m)))
 
 
-	async def view_char(self,m,select=False):
-		if select:
-			char = self.select_char(m.content[8:])
+	async def view_char(self,m,indicator=None):
+		if indicator:
+			char = self.select_char(self.game_key(m),indicator)
 		else:
-			char = self.get_player_char(m.author.id)
-		await m.reply(char.sheet, mention_author=False)
+			char = self.get_player_char(m)
+		self.reply(m, char.sheet)
 
 
 	async def view_cpool(self,m):
-		char = self.get_player_char(m.author.id)
-		await m.reply(char.print_list(char.consequence_list,'Consequences'), mention_author=False)
+		char = self.get_player_char(m)
+		self.reply(m, char.print_list(char.consequence_list,'Consequences'))
 
 
 	async def view_dpool(self,m):
-		char = self.get_player_char(m.author.id)
-		await m.reply(char.print_list(char.dice_list,'DicePool'), mention_author=False)
+		char = self.get_player_char(m)
+		self.reply(m, char.print_list(char.dice_list,'DicePool'))
 
 
 	async def view_dpools(self,m):
-		chars = [c for c in self.characters if len(c.dice)]
+		chars = [c for c in self.characters(self.game_key(m)) if len(c.dice)]
 
 		if not len(chars):
 			raise FeedbackError("No dice pools are active.")
@@ -565,16 +919,16 @@ class Bot():
 			reply += [c.name+':', c.dice_list]
 		reply += ["```"]
 
-		await m.reply("\n".join(reply),mention_author=False)
+		self.reply(m, "\n".join(reply))
 
 
 	async def view_moves(self,m):
-		char = self.get_player_char(m.author.id)
-		await m.reply(char.print_list(char.move_list,'Moves'), mention_author=False)
+		char = self.get_player_char(m)
+		self.reply(m, char.print_list(char.move_list,'Moves'))
 
 
-	async def help(self,m):
-		h_content = m.content[8:]
+	async def help(self,m,topic=None):
+		h_content = topic
 		
 		if h_content == "character":
 			reply = bothelp.character
@@ -589,4 +943,4 @@ class Bot():
 		else:
 			reply = bothelp.default
 
-		await m.reply(reply, mention_author=False)
\ No newline at end of file
+		self.reply(m, reply)
\ No newline at end of file
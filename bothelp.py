@@ -4,11 +4,13 @@ Character Management - `dq help character`
 Rolling - `dq help rolling`
 Using the Dice Pool - `dq help dpool`
 GM Stuff - `dq help gm`
-Glossary - `dq help glossary`"""
+Glossary - `dq help glossary`
+
+Several commands can go in one message, each on its own line starting with `dq`. They all happen or, if one fails, none do. `dq undo`, `dq history` and `dq restore char` only see what's already saved, so they have to come before any line that changes something."""
 
 
 glossary="""`[indicator]`
-	characters, moves, and consequences can be selected using the letter ID they display with or with the first several letters of their name
+	characters, moves, and consequences can be selected using the letter ID they display with or with the first several letters of their name. Longer IDs like AB only count when no name starts with them
 `[dice]`
 	something in the format "xdy", eg "3d6" """
 
@@ -21,6 +23,10 @@ character = """`dq add char [name]`
 	Sets which character you're playing as.
 `dq rename char [name]`
 	Renames your set character to [name].
+`dq import`
+	Add several characters at once. Put each name on its own line after `dq import`, followed by lines of their moves and consequences as `+m [dice] [name]` and `+c [dice] [name]`
+`dq restore char [name]`
+	Brings back a deleted or archived character from this channel whose name starts with [name].
 
 `dq +m [dice] [name]`
 	Add a move or trait to your move list. 
@@ -50,7 +56,14 @@ rolling = """`dq + [indicator]`
 `dq roll [indicator]`
 	Roll and use up the indicated move without adding the results to your dice pool
 `dq roll cs`
-	Roll your consequence pool and clear it"""
+	Roll your consequence pool and clear it
+
+`dq odds [dice]+[dice]... [n]`
+	Exact odds for the sum, the top two and the ones of some dice, eg `dq odds 3d6+2d8 10`. With [n], just the chance of n or more
+`dq odds [indicator] [n]`
+	The same for one of your moves
+`dq odds cs [n]`
+	The same for the top two and ones of your consequence pool"""
 
 
 dpool = """`dq + [n]`
@@ -61,13 +74,21 @@ dpool = """`dq + [n]`
 `dq raise [x] [y]`
 	Raise with one or two specific values from your dice pool
 `dq call [x] [y] [z] ...`
-	Counter/block/dodge/hit with one or more specific values from your dice pool."""
+	Counter/block/dodge/hit with one or more specific values from your dice pool.
+
+`dq undo`
+	Take back the last change to your dice pool, move used or consequence added. Undo again to go further back. Clearing the pools can't be undone, and neither can a move or consequence that's been reset, rolled or deleted since
+`dq history [n]`
+	The last [n] (default 10) changes to your character"""
 
 
 
 gm = """`dq new game [name, name, name...]`
 	Archives all existing characters then starts a new game with the new characters listed.
 
+`dq claim old chars`
+	Bring the characters from before the bot kept a game per channel into this one, archived ones included.
+
 `dq view dpools`
 	View all dice pools.
 
@@ -76,5 +97,13 @@ gm = """`dq new game [name, name, name...]`
 `dq clear cpools`
 	Clear all consequence pools
 `dq clear pools`
-	Do both of the above"""
+	Do both of the above
+
+`dq sim [indicator] [indicator] [trials] [strategy]`
+	Simulate conflicts between two characters' unused moves, the first raising first. [strategy] is how dice get seen: fewest (default) or highest
+
+`dq stats`
+	Command latency and database stats (needs Manage Server).
+`dq reload`
+	Reload the bot's commands without restarting it (bot owner only)."""
 
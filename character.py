@@ -1,16 +1,72 @@
 
+import time
+
 from exceptions import FeedbackError
+from dice import DicePool
+from prefix import PrefixIndex
+from letters import LetterIds, sort_key
 
 class Character():
-	def __init__(self,bot,name=None,db_id=None):
+	# dice pool changes are appended to the journal; the pool itself is only written
+	# back as a snapshot every this many events, so loading replays at most that many
+	snapshot_every = 50
+
+	def __init__(self,bot,name=None,db_id=None,game=None):
 		self.bot = bot
+		self.game = game
 		self._name = name
 		self._char_id = None
 		self._player_id = None
+		self._dice = DicePool()
+		self._moves = []
+		self._consequences = []
+		self._journal_id = 0
+		self._events = 0
+		self._ids = {}
+		self.version = self.names_version = bot.bump(game,names=True)
 		self.db_id = db_id 
 		if not db_id:
 			self.init_record()
 
+	# fill the cached state from rows loaded by Bot.load_characters
+	def load(self,char_id,player_id,dice_pool,journal_id=0):
+		self._char_id = char_id
+		self._player_id = player_id
+		self._dice = DicePool.decode(dice_pool)
+		self._journal_id = journal_id or 0
+
+	# apply a journal event from after the snapshot
+	def replay(self,event_id,added,removed):
+		self._dice.remove(DicePool.decode(removed))
+		self._dice.add(DicePool.decode(added))
+		self._journal_id = event_id
+		self._events += 1
+
+	# call before any change: bumps the version renders are cached under + lets a failed command undo it.
+	# names when it changes what can be looked up by name: the character, its moves or consequences
+	def touch(self,names=False):
+		self.version = self.bot.bump(self.game,names)
+		if names:
+			self.names_version = self.version
+		self.bot.db.remember(self)
+
+	def snapshot(self):
+		return (self.game,self._name,self._char_id,self._player_id,self._dice.copy(),self._moves,self._consequences,self._journal_id,self._events,self.bot.roster(self.game).get(self.db_id) is self)
+
+	def restore(self,snapshot):
+		game = self.game
+		self.game,self._name,self._char_id,self._player_id,self._dice,self._moves,self._consequences,self._journal_id,self._events,active = snapshot
+		if game != self.game:
+			self.bot.roster(game).pop(self.db_id, None)
+			self.bot.bump(game,names=True)
+		self.version = self.names_version = self.bot.bump(self.game,names=True)
+		# letter ids taken get worked out again from what's been put back
+		self._ids = {}
+		if active:
+			self.bot.roster(self.game)[self.db_id] = self
+		else:
+			self.bot.roster(self.game).pop(self.db_id, None)
+
 	@property
 	def name(self):
 		return self._name
@@ -22,51 +78,60 @@ class Character():
 	@property
 	def char_id(self):
 		if not self._char_id:
-			if self.db_id:
-				cur = self.bot.db.execute("SELECT char_id FROM characters WHERE rowid = ?",[self.db_id])
-				self._char_id = cur.fetchone()[0]
-				cur.close()
-			else:
-				self._char_id = self.bot.get_next_char_id()
+			self._char_id = self.bot.get_next_char_id(game=self.game)
 		return self._char_id
 
 	@char_id.setter
 	def char_id(self,v):
+		ids = self.bot.letter_ids(self.game)
+		ids.free(self._char_id)
+		ids.mark(v)
 		self._char_id = v
 
+	# letter ids taken by this character's moves or consequences, rebuilt from them when missing
+	def letter_ids(self,table):
+		if table not in self._ids:
+			self._ids[table] = LetterIds(r[0] for r in (self._moves if table == "moves" else self._consequences))
+		return self._ids[table]
+
 	@property
 	def moves(self):
-		cur = self.bot.db.execute("SELECT char_id,dice,name,used,rowid FROM moves WHERE character_id = ? ORDER BY char_id",[self.db_id])
-		moves = cur.fetchall()
-		cur.close()
-		return moves
+		return list(self._moves)
 
 	@property
 	def consequences(self):
-		cur = self.bot.db.execute("SELECT char_id,dice,name,rowid FROM consequences WHERE character_id = ? ORDER BY char_id",[self.db_id])
-		cqs = cur.fetchall()
-		cur.close()
-		return cqs
+		return list(self._consequences)
 
 	@property
 	def player(self):
-		cur = self.bot.db.execute("SELECT player_id FROM characters WHERE rowid = ?",[self.db_id])
-		pid = cur.fetchone()[0]
-		cur.close()
-		return pid
+		return self._player_id
 
 
 	@player.setter
 	def player(self,v):
+		self.touch()
 		# unset player if set
-		cur = self.bot.db.execute("UPDATE characters SET player_id = '' WHERE player_id = ?",[v])
-		cur.execute("UPDATE characters SET player_id = ? WHERE rowid = ?",[v,self.db_id])
-		self.bot.db.commit()
-		cur.close()
+		self.bot.db.write_many([
+			("UPDATE characters SET player_id = '' WHERE game_id = ? AND player_id = ?",[self.game,v]),
+			("UPDATE characters SET player_id = ? WHERE rowid = ?",[v,self.db_id])
+		])
+
+		v = str(v)
+		old = self.bot.players.get((self.game,v))
+		if old:
+			old.touch()
+			old._player_id = ''
+		if self._player_id:
+			self.bot.players.pop((self.game,self._player_id), None)
+		self._player_id = v
+		self.bot.players[(self.game,v)] = self
+
+	def rendered(self,kind,build):
+		return self.bot.renders.get((kind,self.db_id,self.version),build)
 
 	@property
 	def sheet(self):
-		return '\n'.join([
+		return self.rendered("sheet",lambda: '\n'.join([
 			"```js",
 			self.name,
 			'',
@@ -79,153 +144,236 @@ class Character():
 			"Consequences:",
 			self.consequence_list,
 			"```"
-		])
+		]))
 
 		# select active chars + print them in order of char_id
 	@property
 	def move_list(self):
-		return "\n".join(
-			[f"   {c[0]} - {c[1]} - {c[2]}" for c in self.moves if c[3] == 0] + 
-			[f"// {c[0]} - {c[1]} - {c[2]}" for c in self.moves if c[3] == 1]
-		) if len(self.moves) else "   [empty]"
+		return self.rendered("moves",lambda: "\n".join(
+			[f"   {c[0]} - {c[1]} - {c[2]}" for c in self._moves if c[3] == 0] + 
+			[f"// {c[0]} - {c[1]} - {c[2]}" for c in self._moves if c[3] == 1]
+		) if len(self._moves) else "   [empty]")
 
 		# select active chars + print them in order of char_id
 	@property
 	def consequence_list(self):
-		return "\n".join([f"   {c[0]} - {c[1]} - {c[2]}" for c in self.consequences]) if len(self.consequences) else "   [empty]"
+		return self.rendered("consequences",lambda: "\n".join([f"   {c[0]} - {c[1]} - {c[2]}" for c in self._consequences]) if len(self._consequences) else "   [empty]")
 
 	@property
 	def dice(self):
-		cur = self.bot.db.execute("SELECT dice_pool FROM characters WHERE rowid = ?",[self.db_id])
-		dice = cur.fetchone()[0]
-		cur.close()
-		return sorted(dice.split(' '),key=lambda x:0-int(x)) if dice else []
-
-	@dice.setter
-	def dice(self,v):
-		v = ' '.join(v) if v else None
-		cur = self.bot.db.execute("UPDATE characters SET dice_pool = ? WHERE rowid = ?",[v,self.db_id])
-		self.bot.db.commit()
-		cur.close()
+		return self._dice
 
 	@property
 	def dice_list(self):
-		return '   ' + ", ".join(self.dice) if len(self.dice) else "   [empty]"
-
+		return self.rendered("dice",lambda: '   ' + ", ".join(str(d) for d in self._dice) if len(self._dice) else "   [empty]")
+
+
+	def add_dice(self,values,kind="added",detail=None):
+		self.touch()
+		self._dice.add(values)
+		self.journal(kind,values,(),detail=detail)
+
+	def remove_dice(self,values,kind="removed"):
+		self.touch()
+		try:
+			self._dice.remove(values)
+		except ValueError:
+			raise FeedbackError("You don't have those values in your dice pool!")
+		self.journal(kind,(),values)
+
+	def clear_dice(self):
+		if len(self._dice):
+			self.touch()
+			old = list(self._dice)
+			self._dice = DicePool()
+			self.journal("cleared",(),old)
+
+	# append one event to the journal, folding the pool back into characters.dice_pool
+	# when enough events have piled up since the last snapshot
+	def journal(self,kind,added=(),removed=(),ref=None,detail=None):
+		i = self._journal_id = self.bot.db.next_rowid("journal")
+		statements = [("INSERT INTO journal (id,character_id,kind,added,removed,ref,detail,at) VALUES (?,?,?,?,?,?,?,?)",[i,self.db_id,kind,DicePool(added).encode(),DicePool(removed).encode(),ref,detail,time.time()])]
+
+		self._events += 1
+		if self._events >= self.snapshot_every:
+			statements.append(("UPDATE characters SET dice_pool = ?, journal_id = ? WHERE id = ?",[self._dice.encode(),i,self.db_id]))
+			self._events = 0
+
+		self.bot.db.write_many(statements)
+
+	# take back the last thing journaled for this character that hasn't been undone yet.
+	# the undo is journaled too, as the opposite change, so replays stay append only.
+	# moves being reset and consequences being rolled, cleared or deleted aren't
+	# journaled, so anything they've since changed is refused rather than half undone
+	async def undo(self):
+		rows = await self.bot.db.read("SELECT id,kind,added,removed,ref,detail FROM journal WHERE character_id = ? AND undone = 0 AND kind != 'undo' ORDER BY id DESC LIMIT 1",[self.db_id])
+		if not rows:
+			raise FeedbackError("There's nothing to undo!")
+		i,kind,added,removed,ref,detail = rows[0]
+
+		move = next((x for x in self._moves if x[4] == ref), None)
+		consequence = next((x for x in self._consequences if x[3] == ref), None)
+		if kind == "cleared":
+			raise FeedbackError("Clearing the dice pools can't be undone, it reset the moves too.")
+		if kind == "move used" and not (move and move[3]):
+			raise FeedbackError("That move has been deleted or reset since, so it can't be undone.")
+		if kind == "consequence added" and not consequence:
+			raise FeedbackError("That consequence has been rolled, cleared or deleted since, so it can't be undone.")
+
+		self.touch(names=kind == "consequence added")
+		try:
+			self._dice.remove(DicePool.decode(added))
+		except ValueError:
+			raise FeedbackError("The dice from that are already gone from your pool!")
+		self._dice.add(DicePool.decode(removed))
+
+		if kind == "move used":
+			self.bot.db.write("UPDATE moves SET used = 0 WHERE id = ?",[ref])
+			self._moves = [x if x[4] != ref else x[:3]+(0,)+x[4:] for x in self._moves]
+		if kind == "consequence added":
+			self.bot.db.write("DELETE FROM consequences WHERE id = ?",[ref])
+			self._consequences = [x for x in self._consequences if x[3] != ref]
+			self.letter_ids("consequences").free(consequence[0])
+
+		self.bot.db.write("UPDATE journal SET undone = 1 WHERE id = ?",[i])
+		self.journal("undo",DicePool.decode(removed),DicePool.decode(added),i,kind)
+		return kind, detail
+
+	async def history(self,n=10):
+		return await self.bot.db.read("SELECT kind,added,removed,detail,undone FROM journal WHERE character_id = ? ORDER BY id DESC LIMIT ?",[self.db_id,n])
 
 	def clean_string(self,s):
 		return s.replace('"','').replace("'",'').replace('`','').replace('//','').replace('#','').replace('(','').replace('[','').replace('{','').replace(':','').replace('\\','').replace(';','')
 
 	def init_record(self):
-		cursor = self.bot.db.cursor()
-		cursor.execute("INSERT INTO characters (name,active,char_id) VALUES (?,?,?)", [self.clean_string(self.name), 1, self.char_id])
-		self.bot.db.commit()
-		i = cursor.lastrowid
-		cursor.close()
-		self.db_id = i
+		self._name = self.clean_string(self.name)
+		i = self.db_id = self.bot.db.next_rowid("characters")
+		self.touch(names=True)
+		self.bot.db.write("INSERT INTO characters (rowid,name,active,char_id,game_id) VALUES (?,?,?,?,?)", [i, self.name, 1, self.char_id, self.game])
+		self.bot.roster(self.game)[i] = self
 
 
-	def add_consequence(self,c):
+	def add_consequence(self,c,journal=True):
+		self.touch(names=True)
 		dice = 'd'.join(str(d) for d in self.bot.parse_dice(c.split(' ')[0]))
 		c = c[c.index(' ')+1:] if len(c.split(' ')) > 1 else ''
-		char_id = self.bot.get_next_char_id('consequences', self.db_id)
+		char_id = self.bot.get_next_char_id('consequences', self.db_id, self.game)
+		name = self.clean_string(c)
+
+		i = self.bot.db.next_rowid("consequences")
+		self.bot.db.write("INSERT INTO consequences(rowid, name, dice, char_id, character_id) VALUES (?,?,?,?,?)", [i, name, dice, char_id, self.db_id])
 
-		cursor = self.bot.db.cursor()
-		cursor.execute("INSERT INTO consequences(name, dice, char_id, character_id) VALUES (?,?,?,?)", [self.clean_string(c), dice, char_id, self.db_id])
-		self.bot.db.commit()
-		cursor.close()
+		self._consequences = sorted(self._consequences + [(char_id,dice,name,i)], key=lambda x:sort_key(x[0]))
+		if journal:
+			self.journal("consequence added",ref=i,detail=f"{dice} {name}")
 
 	def add_move(self,c):
+		self.touch(names=True)
 		dice = 'd'.join(str(d) for d in self.bot.parse_dice(c.split(' ')[0]))
 		
 		if not len(c.split(' ')) > 1:
 			raise FeedbackError("You must include a label for your move! eg, `dq +m 2d6 Body`")
 		c = c[c.index(' ')+1:]
 		
-		char_id = self.bot.get_next_char_id('moves', self.db_id)
+		char_id = self.bot.get_next_char_id('moves', self.db_id, self.game)
+		name = self.clean_string(c)
+
+		i = self.bot.db.next_rowid("moves")
+		self.bot.db.write("INSERT INTO moves(rowid, name, dice, char_id, character_id, used) VALUES (?,?,?,?,?,0)", [i, name, dice, char_id, self.db_id])
 
-		cursor = self.bot.db.cursor()
-		cursor.execute("INSERT INTO moves(name, dice, char_id, character_id, used) VALUES (?,?,?,?,0)", [self.clean_string(c), dice, char_id, self.db_id])
-		self.bot.db.commit()
-		cursor.close()
+		self._moves = sorted(self._moves + [(char_id,dice,name,0,i)], key=lambda x:sort_key(x[0]))
 
 	def clear_consequences(self):
-		cursor = self.bot.db.cursor()
-		cursor.execute("DELETE FROM consequences WHERE character_id = ?",[self.db_id])
-		self.bot.db.commit()
-		cursor.close()
+		self.touch(names=True)
+		self.bot.db.write("DELETE FROM consequences WHERE character_id = ?",[self.db_id])
+		self._consequences = []
+		self._ids.pop("consequences", None)
 
+	# false if it's already gone, eg archived by dq new game while a del char waited on Y/n
 	def archive(self):
-		cursor = self.bot.db.cursor()
-		cursor.execute("UPDATE characters SET active = 0 WHERE rowid = ?",[self.db_id])
-		self.bot.db.commit()
-		cursor.close()
-
+		if self.bot.roster(self.game).get(self.db_id) is not self:
+			return False
+		self.touch(names=True)
+		self.bot.db.write("UPDATE characters SET active = 0 WHERE rowid = ?",[self.db_id])
+		self.bot.roster(self.game).pop(self.db_id, None)
+		self.bot.letter_ids(self.game).free(self._char_id)
+		if self._player_id and self.bot.players.get((self.game,self._player_id)) is self:
+			del self.bot.players[(self.game,self._player_id)]
+		return True
+
+	# move a character from before games were per channel (game None) into game, with a
+	# new letter if its own is taken there and without a player who already has one there
+	def adopt(self,game):
+		self.touch(names=True)
+		self.bot.roster(self.game).pop(self.db_id, None)
+		if self._player_id and self.bot.players.get((self.game,self._player_id)) is self:
+			del self.bot.players[(self.game,self._player_id)]
+		self.bot.char_ids.pop(self.game, None)
+
+		ids = self.bot.letter_ids(game)
+		if not self._char_id or any(c._char_id == self._char_id for c in self.bot.roster(game).values()):
+			self._char_id = ids.take()
+		else:
+			ids.mark(self._char_id)
+		if (game,self._player_id) in self.bot.players:
+			self._player_id = ''
+
+		self.game = game
+		self.version = self.names_version = self.bot.bump(game,names=True)
+		self.bot.roster(game)[self.db_id] = self
+		if self._player_id:
+			self.bot.players[(game,self._player_id)] = self
+		self.bot.db.write("UPDATE characters SET game_id = ?, char_id = ?, player_id = ? WHERE id = ?",[game,self._char_id,self._player_id,self.db_id])
+
+	# select before touch: the index is cached under names_version, and touch moves it on
 	def del_consequence(self,c):
 		consequence = self.select_consequence(c)
-		cursor = self.bot.db.cursor()
-		cursor.execute("DELETE FROM consequences WHERE rowid = ?",[consequence[3]])
-		self.bot.db.commit()
-		cursor.close()
+		self.touch(names=True)
+		self.bot.db.write("DELETE FROM consequences WHERE rowid = ?",[consequence[3]])
+		self._consequences = [x for x in self._consequences if x[3] != consequence[3]]
+		self.letter_ids("consequences").free(consequence[0])
 
 	def del_move(self,m):
 		move = self.select_move(m)
-		cursor = self.bot.db.cursor()
-		cursor.execute("DELETE FROM moves WHERE rowid = ?",[move[4]])
-		self.bot.db.commit()
-		cursor.close()
+		self.touch(names=True)
+		self.bot.db.write("DELETE FROM moves WHERE rowid = ?",[move[4]])
+		self._moves = [x for x in self._moves if x[4] != move[4]]
+		self.letter_ids("moves").free(move[0])
 
-	def select_move(self,c):
-		if len(c) == 1:
-			m = next((con for con in self.moves if con[0] == c), None)
-		else:
-			m = next((con for con in self.moves if con[2].lower().startswith(c.lower())), None)
+	# moves and consequences by name prefix, rebuilt only when they're added, removed or
+	# renamed. rows change without their names (a move being used), so the index gives
+	# the rowid (at key) and the current row is looked up from that
+	def index(self,kind,rows,key):
+		return self.bot.renders.get((kind+" index",self.db_id,self.names_version),lambda: PrefixIndex([(r[0],r[2],r[key]) for r in rows]))
 
-		if m:
-			return m
-
-		raise FeedbackError("Couldn't find that move")
+	def select_move(self,c):
+		i = self.index("move",self._moves,4).find(c,"move")
+		return next(x for x in self._moves if x[4] == i)
 
 	def select_consequence(self,c):
-		if len(c) == 1:
-			c = next((con for con in self.consequences if con[0] == c), None)
-		else:
-			c = next((con for con in self.consequences if con[2].lower().startswith(c.lower())), None)
-		
-		if c:
-			return c
-
-		raise FeedbackError("Couldn't find that consequence")
+		i = self.index("consequence",self._consequences,3).find(c,"consequence")
+		return next(x for x in self._consequences if x[3] == i)
 
 	def print_list(self,l,title):
 		return f"```js\n{self.name}\n\n{title}:\n{l}\n```"
 
+	# mark a move used, with whatever it rolled into the pool, as one journal event
+	def use_move(self,move,rolls=()):
+		self.set_move_as_used(move)
+		self._dice.add(rolls)
+		self.journal("move used",rolls,(),move[4],f"{move[1]} {move[2]}")
+
 	def set_move_as_used(self,move):
-		cursor = self.bot.db.cursor()
-		cursor.execute("UPDATE moves SET used = 1 WHERE rowid = ?",[move[4]])
-		self.bot.db.commit()
-		cursor.close()
+		self.touch()
+		self.bot.db.write("UPDATE moves SET used = 1 WHERE rowid = ?",[move[4]])
+		self._moves = [x if x[4] != move[4] else x[:3]+(1,)+x[4:] for x in self._moves]
 
 	def reset_moves(self):
-		cursor = self.bot.db.cursor()
-		cursor.execute("UPDATE moves SET used = 0 WHERE character_id = ?",[self.db_id])
-		self.bot.db.commit()
-		cursor.close()
+		self.touch()
+		self.bot.db.write("UPDATE moves SET used = 0 WHERE character_id = ?",[self.db_id])
+		self._moves = [x[:3]+(0,)+x[4:] for x in self._moves]
 
 	def rename(self,name):
-		cursor = self.bot.db.cursor()
-		cursor.execute("UPDATE characters SET name = ? WHERE rowid = ?",[name,self.db_id])
-		self.bot.db.commit()
-		cursor.close()
-
-
-
-
-
-
-
-
-
-
-
-
+		self.touch(names=True)
+		self.bot.db.write("UPDATE characters SET name = ? WHERE rowid = ?",[name,self.db_id])
+		self._name = name
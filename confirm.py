@@ -0,0 +1,51 @@
+import heapq
+import time
+from collections import Counter
+
+
+# pending Y/n confirmations, one per (game, user). each expires after ttl seconds; the
+# expiry times sit in a heap so a sweep only ever looks at entries that are already due
+class Confirmations():
+	def __init__(self,ttl=120):
+		self.ttl = ttl
+		self.pending = {}
+		self.users = Counter()
+		self.expiries = []
+
+	# is this user waiting on a confirmation anywhere
+	def __contains__(self,user):
+		self.sweep()
+		return user in self.users
+
+	def add(self,game,user,action):
+		self.sweep()
+		key = (game,user)
+		if key not in self.pending:
+			self.users[user] += 1
+		expires = time.monotonic()+self.ttl
+		self.pending[key] = (action,expires)
+		heapq.heappush(self.expiries,(expires,key))
+
+	# the pending action for this user in this game, removing it, or None
+	def take(self,game,user):
+		self.sweep()
+		entry = self.pending.pop((game,user),None)
+		if not entry:
+			return None
+		self.forget(user)
+		return entry[0]
+
+	def forget(self,user):
+		self.users[user] -= 1
+		if not self.users[user]:
+			del self.users[user]
+
+	def sweep(self):
+		now = time.monotonic()
+		while self.expiries and self.expiries[0][0] <= now:
+			expires,key = heapq.heappop(self.expiries)
+			# entries that were replaced or already taken leave stale heap items behind
+			entry = self.pending.get(key)
+			if entry and entry[1] == expires:
+				del self.pending[key]
+				self.forget(key[1])
@@ -0,0 +1,122 @@
+import bisect
+import heapq
+import itertools
+import random
+from collections import Counter
+
+from exceptions import FeedbackError
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+
+# generates rolls in bulk: with numpy when it's installed, with random.choices otherwise.
+# rolls bigger than max_listed only come back as a summary, and anything over max_dice is refused
+class Roller():
+	def __init__(self,seed=None,max_listed=100,max_dice=1000000):
+		self.max_listed = max_listed
+		self.max_dice = max_dice
+		self.seed(seed)
+
+	def seed(self,seed=None):
+		self.random = random.Random(seed)
+		self.np = numpy.random.default_rng(seed) if numpy else None
+
+	# amt dice, highest first
+	def roll(self,amt,die):
+		if amt > self.max_listed:
+			raise FeedbackError(f"That's too many dice! (max {self.max_listed})")
+
+		if self.np:
+			rolls = self.np.integers(1,die+1,amt)
+			rolls[::-1].sort()
+			return rolls.tolist()
+
+		return sorted(self.random.choices(range(1,die+1),k=amt),reverse=True)
+
+	# (total, {face: count}) for rolls too big to list. when there are fewer faces than
+	# dice the counts are drawn directly instead of rolling every die
+	def summary(self,amt,die):
+		if amt > self.max_dice:
+			raise FeedbackError(f"That's too many dice! (max {self.max_dice})")
+
+		if self.np and die <= amt:
+			counts = dict(zip(range(1,die+1),self.np.multinomial(amt,[1/die]*die).tolist()))
+		elif self.np:
+			counts = Counter(self.np.integers(1,die+1,amt).tolist())
+		else:
+			counts = Counter(self.random.choices(range(1,die+1),k=amt))
+
+		return sum(f*c for f,c in counts.items()), counts
+
+	# the k highest dice across several rolls, each already sorted highest first
+	def top(self,rolls,k=2):
+		return heapq.nlargest(k,itertools.chain.from_iterable(r[:k] for r in rolls))
+
+	def ones(self,rolls):
+		return rolls.count(1)
+
+
+# a dice pool as a count per face value. faces are kept in order so it iterates
+# highest first without re-sorting. stored as "face:count" pairs, eg "6:2,4:1"
+class DicePool():
+	def __init__(self,values=()):
+		self.counts = {}
+		self.faces = []
+		self.size = 0
+		self.add(values)
+
+	@classmethod
+	def decode(cls,s):
+		pool = cls()
+		if s:
+			for pair in s.split(','):
+				face,count = pair.split(':')
+				pool.add_face(int(face),int(count))
+		return pool
+
+	def encode(self):
+		return ','.join(f"{f}:{self.counts[f]}" for f in reversed(self.faces)) or None
+
+	def copy(self):
+		pool = DicePool()
+		pool.counts = dict(self.counts)
+		pool.faces = list(self.faces)
+		pool.size = self.size
+		return pool
+
+	def add_face(self,face,count=1):
+		if face not in self.counts:
+			bisect.insort(self.faces,face)
+			self.counts[face] = 0
+		self.counts[face] += count
+		self.size += count
+
+	def add(self,values):
+		for v in values:
+			self.add_face(v)
+
+	# all or nothing: raises ValueError, leaving the pool alone, if any value is missing
+	def remove(self,values):
+		needed = Counter(values)
+		if any(self.counts.get(f,0) < c for f,c in needed.items()):
+			raise ValueError("Values not in pool")
+
+		for f,c in needed.items():
+			self.counts[f] -= c
+			self.size -= c
+			if not self.counts[f]:
+				del self.counts[f]
+				self.faces.remove(f)
+
+	def __contains__(self,face):
+		return face in self.counts
+
+	def __len__(self):
+		return self.size
+
+	def __iter__(self):
+		for f in reversed(self.faces):
+			yield from itertools.repeat(f,self.counts[f])
@@ -0,0 +1,55 @@
+import string
+
+ALPHABET = string.ascii_uppercase+string.ascii_lowercase
+
+
+# the nth letter id: A-Z, a-z, then two letters (AA, AB ... zz), then three and so on
+def letter(n):
+	width = 1
+	while n >= len(ALPHABET)**width:
+		n -= len(ALPHABET)**width
+		width += 1
+
+	s = ''
+	for _ in range(width):
+		n, i = divmod(n,len(ALPHABET))
+		s = ALPHABET[i]+s
+	return s
+
+# where a letter id comes in that order, or None if it isn't one
+def index(s):
+	if not s or any(c not in ALPHABET for c in s):
+		return None
+	n = 0
+	for c in s:
+		n = n*len(ALPHABET)+ALPHABET.index(c)
+	return n+sum(len(ALPHABET)**w for w in range(1,len(s)))
+
+# sorts letter ids in the order they're handed out, so AA comes after z
+def sort_key(s):
+	n = index(s)
+	return (n is None, n or 0, s or '')
+
+
+# the letter ids taken in one scope as the bits of an int. the lowest free one is a
+# couple of int operations, and freed ids are handed out again lowest first
+class LetterIds():
+	def __init__(self,taken=()):
+		self.bits = 0
+		for s in taken:
+			self.mark(s)
+
+	def take(self):
+		n = (~self.bits & (self.bits+1)).bit_length()-1
+		self.bits |= 1 << n
+		return letter(n)
+
+	def mark(self,s):
+		n = index(s)
+		if n is not None:
+			self.bits |= 1 << n
+
+	def free(self,s):
+		n = index(s)
+		if n is not None:
+			self.bits &= ~(1 << n)
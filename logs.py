@@ -0,0 +1,73 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+
+# one line per record: time, level, message, then any fields passed as extra={"fields": {...}}
+class StructuredFormatter(logging.Formatter):
+	def format(self,record):
+		line = f"{self.formatTime(record)} {record.levelname} {record.getMessage()}"
+		fields = getattr(record,"fields",None)
+		if fields:
+			line += ' '+' '.join(f"{k}={v!r}" for k,v in fields.items())
+		if record.exc_info:
+			line += '\n'+self.formatException(record.exc_info)
+		return line
+
+
+# keeps a fraction of each guild's below-warning records; warnings and errors always pass
+class GuildSampler(logging.Filter):
+	def __init__(self,default=1.0):
+		super().__init__()
+		self.default = default
+		self.rates = {}
+
+	def filter(self,record):
+		if record.levelno >= logging.WARNING:
+			return True
+		rate = self.rates.get(getattr(record,"guild",None),self.default)
+		return rate >= 1 or random.random() < rate
+
+	# "0.1,1234:1,5678:0.5": a bare rate is the default, guild:rate pairs override it
+	def configure(self,spec):
+		for part in filter(None,(p.strip() for p in spec.split(','))):
+			if ':' in part:
+				guild, rate = part.split(':')
+				self.rates[int(guild)] = float(rate)
+			else:
+				self.default = float(part)
+
+
+# records are passed to the writer as they are; formatting happens on the writer thread
+class RecordQueueHandler(logging.handlers.QueueHandler):
+	def prepare(self,record):
+		return record
+
+
+# log records go onto a queue straight away and a background thread formats and writes them
+class LogPipeline():
+	def __init__(self,name="dogsbot",level=logging.INFO,stream=None,sample_rate=1.0):
+		self.queue = queue.SimpleQueue()
+		self.sampler = GuildSampler(sample_rate)
+
+		writer = logging.StreamHandler(stream or sys.stdout)
+		writer.setFormatter(StructuredFormatter())
+		self.listener = logging.handlers.QueueListener(self.queue,writer)
+
+		handler = RecordQueueHandler(self.queue)
+		handler.addFilter(self.sampler)
+
+		self.logger = logging.getLogger(name)
+		self.logger.setLevel(level)
+		self.logger.propagate = False
+		self.logger.handlers = [handler]
+
+		self.listener.start()
+		atexit.register(self.stop)
+
+	def stop(self):
+		if self.listener._thread:
+			self.listener.stop()
@@ -2,20 +2,21 @@
 from config import TOKEN
 from bot import Bot
 
-global b
 
+# only run as a script: the simulator's worker processes import this module too
+def main():
+	b = Bot(False)
 
-if __name__ == "__main__":
-    b = Bot(False)
-else:
-	exit()
+	@b.client.event
+	async def on_ready():
+		await b.on_ready()
+
+	@b.client.event
+	async def on_message(message):
+		await b.on_message(message)
 
-@b.client.event
-async def on_ready():
-	await b.on_ready()
+	b.start_bot(TOKEN)
 
-@b.client.event
-async def on_message(message):
-	await b.on_message(message)
 
-b.start_bot(TOKEN)
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import threading
+from collections import Counter
+
+
+BUCKETS = [0.0005,0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5]
+
+
+class Histogram():
+	def __init__(self):
+		self.buckets = [0]*(len(BUCKETS)+1)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self,v):
+		i = next((i for i,b in enumerate(BUCKETS) if v <= b),len(BUCKETS))
+		self.buckets[i] += 1
+		self.count += 1
+		self.sum += v
+
+	# upper bound of the bucket the q-th observation falls in
+	def quantile(self,q):
+		seen = 0
+		for i,n in enumerate(self.buckets):
+			seen += n
+			if seen >= q*self.count:
+				return BUCKETS[i] if i < len(BUCKETS) else float("inf")
+		return 0.0
+
+
+# per-command latency and query counts plus database totals. the totals are bumped from
+# the storage threads, so they go through a lock
+class Metrics():
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.totals = Counter()
+		self.latency = {}
+		self.queries = Counter()
+		self.commit_latency = Histogram()
+
+	def count(self,name,n=1):
+		with self.lock:
+			self.totals[name] += n
+
+	def observe(self,command,seconds,queries=0):
+		self.latency.setdefault(command,Histogram()).observe(seconds)
+		self.queries[command] += queries
+
+	def observe_commit(self,seconds):
+		self.commit_latency.observe(seconds)
+
+	def summary(self):
+		lines = [f"{'command':<18} {'n':>6} {'p50 ms':>7} {'p99 ms':>7} {'q/cmd':>6}"]
+		for command,h in sorted(self.latency.items(),key=lambda x:-x[1].count):
+			lines += [f"{command:<18} {h.count:>6} {h.quantile(0.5)*1000:>7g} {h.quantile(0.99)*1000:>7g} {self.queries[command]/h.count:>6.2f}"]
+		with self.lock:
+			totals = dict(self.totals)
+		lines += ['',' '.join(f"{k}={v}" for k,v in sorted(totals.items())) or "no queries yet"]
+		return '\n'.join(lines)
+
+	# prometheus text exposition format
+	def exposition(self,prefix="dogsbot"):
+		lines = [f"# TYPE {prefix}_command_seconds histogram"]
+		for command,h in sorted(self.latency.items()):
+			lines += self.histogram_lines(f"{prefix}_command_seconds",h,f'command="{command}"')
+		lines += [f"# TYPE {prefix}_command_queries_total counter"]
+		lines += [f'{prefix}_command_queries_total{{command="{c}"}} {n}' for c,n in sorted(self.queries.items())]
+		lines += [f"# TYPE {prefix}_commit_seconds histogram"]
+		lines += self.histogram_lines(f"{prefix}_commit_seconds",self.commit_latency)
+		with self.lock:
+			totals = dict(self.totals)
+		for k,v in sorted(totals.items()):
+			lines += [f"# TYPE {prefix}_db_{k}_total counter",f"{prefix}_db_{k}_total {v}"]
+		return '\n'.join(lines)+'\n'
+
+	def histogram_lines(self,name,h,labels=''):
+		sep = ',' if labels else ''
+		lines = []
+		seen = 0
+		for b,n in zip(BUCKETS+["+Inf"],h.buckets):
+			seen += n
+			lines += [f'{name}_bucket{{{labels}{sep}le="{b}"}} {seen}']
+		labels = f"{{{labels}}}" if labels else ''
+		return lines+[f"{name}_sum{labels} {h.sum}",f"{name}_count{labels} {h.count}"]
+
+	def write(self,path):
+		tmp = path+".tmp"
+		with open(tmp,"w") as f:
+			f.write(self.exposition())
+		os.replace(tmp,path)
+
+	async def export_every(self,path,interval=60):
+		while True:
+			await asyncio.sleep(interval)
+			await asyncio.get_running_loop().run_in_executor(None,self.write,path)
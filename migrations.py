@@ -0,0 +1,120 @@
+from collections import Counter
+
+
+# schema history. each step runs once, in order, inside its own transaction, and
+# schema_version records the last one applied. only ever append new steps here
+
+
+def create_tables(con):
+	con.execute("CREATE TABLE IF NOT EXISTS characters (name text, active int, char_id text, player_id text, dice_pool text)")
+	con.execute("CREATE TABLE IF NOT EXISTS moves (char_id text, character_id int, dice text, name text, used int)")
+	con.execute("CREATE TABLE IF NOT EXISTS consequences (char_id text, character_id int, dice text, name text)")
+
+
+# rebuild the tables with integer primary keys (aliasing the rowids everything already
+# uses) so moves and consequences can reference their character
+def add_foreign_keys(con):
+	con.execute("DROP INDEX IF EXISTS characters_player_id")
+
+	con.execute("ALTER TABLE characters RENAME TO characters_old")
+	con.execute("CREATE TABLE characters (id integer PRIMARY KEY, name text, active int, char_id text, player_id text, dice_pool text)")
+	con.execute("INSERT INTO characters (id,name,active,char_id,player_id,dice_pool) SELECT rowid,name,active,char_id,player_id,dice_pool FROM characters_old")
+
+	con.execute("ALTER TABLE moves RENAME TO moves_old")
+	con.execute("CREATE TABLE moves (id integer PRIMARY KEY, char_id text, character_id int NOT NULL REFERENCES characters (id) ON DELETE CASCADE, dice text, name text, used int)")
+	con.execute("INSERT INTO moves (id,char_id,character_id,dice,name,used) SELECT rowid,char_id,character_id,dice,name,used FROM moves_old WHERE character_id IN (SELECT id FROM characters)")
+
+	con.execute("ALTER TABLE consequences RENAME TO consequences_old")
+	con.execute("CREATE TABLE consequences (id integer PRIMARY KEY, char_id text, character_id int NOT NULL REFERENCES characters (id) ON DELETE CASCADE, dice text, name text)")
+	con.execute("INSERT INTO consequences (id,char_id,character_id,dice,name) SELECT rowid,char_id,character_id,dice,name FROM consequences_old WHERE character_id IN (SELECT id FROM characters)")
+
+	for t in ["characters_old","moves_old","consequences_old"]:
+		con.execute("DROP TABLE "+t)
+
+
+# one index per hot lookup: the active roster in char_id order, the player lookup,
+# and each character's moves/consequences in char_id order
+def add_indexes(con):
+	con.execute("CREATE INDEX IF NOT EXISTS characters_active ON characters (active, char_id)")
+	con.execute("CREATE INDEX IF NOT EXISTS characters_player_id ON characters (player_id)")
+	con.execute("CREATE INDEX IF NOT EXISTS moves_character_id ON moves (character_id, char_id)")
+	con.execute("CREATE INDEX IF NOT EXISTS consequences_character_id ON consequences (character_id, char_id)")
+
+
+# every game is keyed by guild + channel; rows from before this have no game and stay
+# hidden until a GM claims them for their channel with dq claim old chars
+def add_game_id(con):
+	con.execute("ALTER TABLE characters ADD COLUMN game_id text")
+	con.execute("DROP INDEX IF EXISTS characters_active")
+	con.execute("DROP INDEX IF EXISTS characters_player_id")
+	con.execute("CREATE INDEX characters_game ON characters (game_id, active, char_id)")
+	con.execute("CREATE INDEX characters_game_player ON characters (game_id, player_id)")
+
+
+# dice pools go from every value space separated ("6 5 5 1") to face:count pairs ("6:1,5:2,1:1")
+def encode_dice_pools(con):
+	pools = con.execute("SELECT id,dice_pool FROM characters WHERE dice_pool IS NOT NULL AND dice_pool != ''").fetchall()
+	for i,pool in pools:
+		counts = Counter(int(v) for v in pool.split(' '))
+		encoded = ','.join(f"{f}:{counts[f]}" for f in sorted(counts,reverse=True))
+		con.execute("UPDATE characters SET dice_pool = ? WHERE id = ?",[encoded,i])
+
+
+# dice pool changes become journal events; characters.dice_pool is now a snapshot of the
+# pool as of journal_id, and loading replays the events after it
+def add_journal(con):
+	con.execute("CREATE TABLE journal (id integer PRIMARY KEY, character_id int NOT NULL REFERENCES characters (id) ON DELETE CASCADE, kind text, added text, removed text, ref int, detail text, at real, undone int DEFAULT 0)")
+	con.execute("CREATE INDEX journal_character_id ON journal (character_id, id)")
+	con.execute("ALTER TABLE characters ADD COLUMN journal_id int DEFAULT 0")
+
+
+# archived characters and everything under them get moved here by archive.Archiver
+def add_archive(con):
+	con.execute("CREATE TABLE archive_characters (id integer PRIMARY KEY, name text, active int, char_id text, player_id text, dice_pool text, game_id text, journal_id int, archived_at real)")
+	con.execute("CREATE TABLE archive_moves (id integer PRIMARY KEY, char_id text, character_id int NOT NULL REFERENCES archive_characters (id) ON DELETE CASCADE, dice text, name text, used int)")
+	con.execute("CREATE TABLE archive_consequences (id integer PRIMARY KEY, char_id text, character_id int NOT NULL REFERENCES archive_characters (id) ON DELETE CASCADE, dice text, name text)")
+	con.execute("CREATE TABLE archive_journal (id integer PRIMARY KEY, character_id int NOT NULL REFERENCES archive_characters (id) ON DELETE CASCADE, kind text, added text, removed text, ref int, detail text, at real, undone int)")
+	con.execute("CREATE INDEX archive_characters_game ON archive_characters (game_id, name)")
+	for t in ["moves","consequences","journal"]:
+		con.execute(f"CREATE INDEX archive_{t}_character_id ON archive_{t} (character_id)")
+
+
+migrations = [
+	create_tables,
+	add_foreign_keys,
+	add_indexes,
+	add_game_id,
+	encode_dice_pools,
+	add_journal,
+	add_archive
+]
+
+
+def get_version(con):
+	con.execute("CREATE TABLE IF NOT EXISTS schema_version (version int)")
+	row = con.execute("SELECT version FROM schema_version").fetchone()
+	return row[0] if row else 0
+
+
+def migrate(con,target=None):
+	target = len(migrations) if target is None else target
+	version = get_version(con)
+	con.commit()
+
+	# table rebuilds can't run with foreign keys on, and the pragma is a no-op inside a transaction
+	con.execute("PRAGMA foreign_keys = OFF")
+	try:
+		for v in range(version+1,target+1):
+			con.execute("BEGIN")
+			try:
+				migrations[v-1](con)
+				con.execute("DELETE FROM schema_version")
+				con.execute("INSERT INTO schema_version (version) VALUES (?)",[v])
+				con.commit()
+			except Exception:
+				con.rollback()
+				raise
+	finally:
+		con.execute("PRAGMA foreign_keys = ON")
+
+	return target
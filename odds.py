@@ -0,0 +1,126 @@
+import asyncio
+import math
+from bisect import bisect_left
+from collections import Counter
+
+from exceptions import FeedbackError
+from render import RenderCache
+
+
+# {sum: ways} for amt dice. each die is one sliding window pass over the counts so far
+def sums(amt,die):
+	counts = [1]
+	for _ in range(amt):
+		window = 0
+		new = []
+		for i in range(len(counts)+die-1):
+			if i < len(counts):
+				window += counts[i]
+			if i >= die:
+				window -= counts[i-die]
+			new.append(window)
+		counts = new
+	return {amt+i: c for i,c in enumerate(counts)}
+
+# {number of ones: ways} for amt dice
+def ones(amt,die):
+	return {k: math.comb(amt,k)*(die-1)**(amt-k) for k in range(amt+1)}
+
+def convolve(a,b):
+	out = {}
+	for x,i in a.items():
+		for y,j in b.items():
+			out[x+y] = out.get(x+y,0)+i*j
+	return out
+
+# {sum of the two highest dice: ways}, counted the way dq roll cs adds them up: a
+# single die is its own top two. the state is the (highest, second highest) seen so far
+def top_two(dice):
+	states = {(0,0): 1}
+	for die in dice:
+		new = {}
+		for (a,b),ways in states.items():
+			# faces at or under the second highest change nothing
+			low = min(b,die)
+			if low:
+				new[(a,b)] = new.get((a,b),0)+ways*low
+			for f in range(low+1,die+1):
+				s = (f,a) if f > a else (a,f)
+				new[s] = new.get(s,0)+ways
+		states = new
+
+	out = {}
+	for (a,b),ways in states.items():
+		out[a+b] = out.get(a+b,0)+ways
+	return out
+
+
+# every outcome of a pool of dice, counted exactly. dice is ((die, amt), ...). the chance
+# of each value or more is worked out once here, so replies only look them up
+class Distribution():
+	def __init__(self,dice):
+		self.dice = dice
+		self.outcomes = math.prod(die**amt for die,amt in dice)
+		self.sums = {0: 1}
+		self.ones = {0: 1}
+		for die,amt in dice:
+			self.sums = convolve(self.sums,sums(amt,die))
+			self.ones = convolve(self.ones,ones(amt,die))
+		self.top_two = top_two([die for die,amt in reversed(dice) for _ in range(amt)])
+
+		self.tails = {}
+		self.means = {}
+		for name in ("sums","top_two","ones"):
+			counts = getattr(self,name)
+			values = sorted(v for v,w in counts.items() if w)
+			chances = []
+			ways = 0
+			for v in reversed(values):
+				ways += counts[v]
+				chances.append(ways/self.outcomes)
+			self.tails[name] = (values,chances[::-1])
+			self.means[name] = sum(v*w for v,w in counts.items())/self.outcomes
+
+	# the values name ("sums", "top_two" or "ones") can come out as, lowest first
+	def values(self,name):
+		return self.tails[name][0]
+
+	def at_least(self,name,n):
+		values, chances = self.tails[name]
+		i = bisect_left(values,n)
+		return chances[i] if i < len(values) else 0.0
+
+	def mean(self,name):
+		return self.means[name]
+
+
+# exact odds for pools of dice, kept per multiset of dice so 3d6+2d8 and 2d8+3d6 (or a
+# move and a consequence with the same dice) share one entry. a big pool at the caps
+# takes over half a second to count, so misses are worked out in an executor, and
+# messages asking for the same pool at once wait on the one computation
+class Odds():
+	def __init__(self,size=256,max_dice=100,max_die=20):
+		self.max_dice = max_dice
+		self.max_die = max_die
+		self.results = RenderCache(size)
+		self.running = {}
+
+	# dice is [(amt, die), ...]
+	async def pool(self,dice,executor=None):
+		counts = Counter()
+		for amt,die in dice:
+			counts[die] += amt
+
+		if sum(counts.values()) > self.max_dice or max(counts) > self.max_die:
+			raise FeedbackError(f"That's too many dice to work out! (max {self.max_dice} dice up to d{self.max_die})")
+
+		key = tuple(sorted(counts.items()))
+		if key not in self.results:
+			if key not in self.running:
+				self.running[key] = asyncio.get_running_loop().run_in_executor(executor,Distribution,key)
+			try:
+				distribution = await self.running[key]
+			finally:
+				self.running.pop(key,None)
+			return self.results.get(key,lambda: distribution)
+		return self.results.get(key,None)
@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+
+LIMIT = 2000
+
+
+class TokenBucket():
+	def __init__(self,rate,burst):
+		self.rate = rate
+		self.burst = burst
+		self.tokens = burst
+		self.last = time.monotonic()
+
+	async def take(self):
+		while True:
+			now = time.monotonic()
+			self.tokens = min(self.burst,self.tokens+(now-self.last)*self.rate)
+			self.last = now
+			if self.tokens >= 1:
+				self.tokens -= 1
+				return
+			await asyncio.sleep((1-self.tokens)/self.rate)
+
+
+# split a long reply on line breaks so every piece fits in one discord message,
+# closing any ``` block at the end of a piece and reopening it at the start of the next
+def split(content,limit=LIMIT):
+	if len(content) <= limit:
+		return [content]
+
+	pieces = []
+	lines = []
+	size = 0
+	fence = None
+
+	for line in content.split('\n'):
+		for part in [line[i:i+limit-8] for i in range(0,len(line),limit-8)] or ['']:
+			if size+len(part)+1 > limit-4:
+				pieces.append('\n'.join(lines+(['```'] if fence else [])))
+				lines = [fence] if fence else []
+				size = len(fence)+1 if fence else 0
+
+			lines.append(part)
+			size += len(part)+1
+			if part.count('```')%2:
+				fence = None if fence else (part.strip() if part.strip().startswith('```') else '```')
+
+	pieces.append('\n'.join(lines))
+	return [p for p in pieces if p]
+
+
+# replies go into a queue per channel instead of being awaited by the handler. each
+# channel is paced by a token bucket, replies that pile up while it waits (or within
+# `window` of the first) are merged into one message, and long ones are split
+class Outbox():
+	def __init__(self,log=print,window=0.1,rate=1,burst=5,small=600):
+		self.log = log
+		self.window = window
+		self.rate = rate
+		self.burst = burst
+		self.small = small
+		self.queues = {}
+		self.buckets = {}
+		self.tasks = set()
+
+	def send(self,m,content):
+		channel = m.channel.id
+		if channel not in self.queues:
+			self.queues[channel] = []
+			task = asyncio.get_running_loop().create_task(self.deliver(channel))
+			self.tasks.add(task)
+			task.add_done_callback(self.tasks.discard)
+		self.queues[channel].append((m,str(content)))
+
+	# (message to reply to, text) pairs: runs of small replies merged, big ones split
+	def pack(self,batch):
+		packed = []
+		for m,content in batch:
+			if packed and len(content) <= self.small and len(packed[-1][1]) <= LIMIT-len(content)-2 and packed[-1][2]:
+				packed[-1] = (packed[-1][0],packed[-1][1]+"\n\n"+content,True)
+			else:
+				packed += [(m,piece,len(content) <= self.small) for piece in split(content)]
+		return [(m,content) for m,content,small in packed]
+
+	async def deliver(self,channel):
+		queue = self.queues[channel]
+		bucket = self.buckets.setdefault(channel,TokenBucket(self.rate,self.burst))
+		try:
+			await asyncio.sleep(self.window)
+			while queue:
+				batch = queue[:]
+				queue.clear()
+				for m,content in self.pack(batch):
+					await bucket.take()
+					try:
+						await m.reply(content,mention_author=False)
+					except Exception as e:
+						self.log(f"Couldn't deliver reply in {channel}: {e}")
+		finally:
+			del self.queues[channel]
+
+	# wait for everything queued so far to be sent
+	async def drain(self):
+		while self.tasks:
+			await asyncio.gather(*list(self.tasks))
@@ -0,0 +1,57 @@
+from bisect import bisect_left
+
+from exceptions import FeedbackError
+
+
+# names case folded and sorted, so everything starting with a prefix is one slice found
+# with two bisects, plus the letter ids for exact lookups. built from (id, name, value)
+class PrefixIndex():
+	def __init__(self,items):
+		items = list(items)
+		self.ids = {id: (f"{id} - {name}",value) for id,name,value in items}
+		items = sorted(((name.casefold(),f"{id} - {name}",value) for id,name,value in items),key=lambda i:i[:2])
+		self.keys = [i[0] for i in items]
+		self.labels = [i[1] for i in items]
+		self.values = [i[2] for i in items]
+
+	def span(self,prefix):
+		return bisect_left(self.keys,prefix), bisect_left(self.keys,prefix+'\U0010ffff')
+
+	# a single letter is only ever an id. anything longer is the one value whose name
+	# starts with prefix or is exactly it, and a letter id like AB only when no name
+	# starts with it, so ids past z never hide a name
+	def find(self,prefix,what):
+		if len(prefix) == 1:
+			if prefix in self.ids:
+				return self.ids[prefix][1]
+			raise FeedbackError(f"Couldn't find that {what}")
+
+		p = prefix.casefold()
+		lo, hi = self.span(p)
+		if hi-lo == 1:
+			return self.values[lo]
+
+		if hi > lo:
+			exact = [i for i in range(lo,hi) if self.keys[i] == p]
+			if len(exact) == 1:
+				return self.values[exact[0]]
+			also = f" ({prefix} is also the letter for {self.ids[prefix][0]})" if prefix in self.ids else ''
+			raise FeedbackError(f"\"{prefix}\" could be {self.listed(lo,hi)}{also}. Use more of the name or the letter")
+
+		if prefix in self.ids:
+			return self.ids[prefix][1]
+
+		suggestions = self.suggest(p)
+		raise FeedbackError(f"Couldn't find that {what}" + (f". Did you mean {suggestions}?" if suggestions else ''))
+
+	# the names sharing the longest prefix with what was asked for
+	def suggest(self,p,n=3):
+		for k in range(len(p)-1,0,-1):
+			lo, hi = self.span(p[:k])
+			if hi > lo:
+				return self.listed(lo,hi,n)
+		return ''
+
+	def listed(self,lo,hi,n=5):
+		labels = self.labels[lo:min(hi,lo+n)]
+		return ', '.join(labels) + (f" or {hi-lo-n} more" if hi-lo > n else '')
@@ -0,0 +1,31 @@
+import atexit
+import json
+import time
+
+
+# writes every message on_message handles, and every reply to it, to a JSON lines file
+# that benchmarks/replay.py can play back
+class Recorder():
+	def __init__(self,path):
+		self.file = open(path,"a")
+		atexit.register(self.close)
+
+	def message(self,m):
+		self.write({
+			"id": m.id,
+			"t": time.time(),
+			"guild": m.guild.id if m.guild else None,
+			"channel": m.channel.id,
+			"author": m.author.id,
+			"content": m.content
+		})
+
+	def reply(self,m,content):
+		self.write({"reply_to": m.id, "content": str(content)})
+
+	def write(self,entry):
+		self.file.write(json.dumps(entry)+"\n")
+
+	def close(self):
+		if not self.file.closed:
+			self.file.close()
@@ -0,0 +1,25 @@
+from collections import OrderedDict
+
+
+# rendered strings keyed by whatever they were built from, usually including a
+# version that changes on every write so stale entries are never hit, just aged out
+class RenderCache():
+	def __init__(self,size=4096):
+		self.size = size
+		self.entries = OrderedDict()
+
+	def __contains__(self,key):
+		return key in self.entries
+
+	def get(self,key,build):
+		if key in self.entries:
+			self.entries.move_to_end(key)
+			return self.entries[key]
+
+		value = self.entries[key] = build()
+		if len(self.entries) > self.size:
+			self.entries.popitem(last=False)
+		return value
+
+	def clear(self):
+		self.entries.clear()
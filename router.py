@@ -0,0 +1,64 @@
+import re
+
+
+# argument grammars a route can use, as {name:grammar}. a bare {name} takes the rest of the text
+grammars = {
+	"text": r".+",
+	"word": r"\S+",
+	"dice": r"\d+d\d+",
+	"pool": r"\d+d\d+(?:\+\d+d\d+)*",
+	"int": r"-?\d+",
+}
+
+
+# routes are bucketed by their first word, and each bucket is compiled into one regex
+# alternation, so resolving a command and pulling out its arguments is a dict lookup
+# plus a single match no matter how many routes there are
+class Router():
+	def __init__(self,routes=()):
+		self.routes = []
+		self.buckets = None
+		for route in routes:
+			self.add(*route)
+
+	# routes with free text arguments go last so literal and typed routes win,
+	# otherwise routes are tried in the order they were added
+	def add(self,route,handler,**kwargs):
+		self.routes.append((route,handler,kwargs))
+		self.routes.sort(key=lambda r:len(re.findall(r"\{\w+(?::text)?\}",r[0])))
+		self.buckets = None
+
+	def compile(self):
+		alternatives = {}
+		self.args = []
+
+		for i,(route,handler,kwargs) in enumerate(self.routes):
+			regex = ''
+			args = []
+			for literal,name,grammar in re.findall(r"([^{]*)(?:\{(\w+)(?::(\w+))?\})?",route):
+				regex += re.escape(literal)
+				if name:
+					regex += f"(?P<r{i}_{name}>{grammars[grammar or 'text']})"
+					args.append(name)
+			self.args.append(args)
+
+			key = route.split(None,1)[0]
+			if '{' in key:
+				raise ValueError("Routes must start with a literal word: "+route)
+			alternatives.setdefault(key,[]).append(f"(?P<r{i}>{regex}\\Z)")
+
+		self.buckets = {k:re.compile("|".join(a),re.DOTALL) for k,a in alternatives.items()}
+
+	# (handler, kwargs) for the text, or None if no route matches
+	def resolve(self,text):
+		if self.buckets is None:
+			self.compile()
+
+		pattern = self.buckets.get((text.split(None,1) or [''])[0])
+		match = pattern and pattern.match(text)
+		if not match:
+			return None
+
+		i = int(match.lastgroup[1:])
+		route,handler,kwargs = self.routes[i]
+		return handler, dict(kwargs,**{a:match.group(f"r{i}_{a}") for a in self.args[i]})
@@ -0,0 +1,228 @@
+# monte carlo conflicts between two pools of dice, the way dq raise and dq call play
+# out: the raiser puts up their two highest dice, the seer answers with one die (a
+# counter, which they raise with next), two (a block) or three or more (a hit, taking
+# that many consequence dice), and whoever can't raise or can't see gives. every trial
+# in a batch moves through the same exchange at once as numpy arrays
+#
+#   python sim.py 3d6+2d8 4d6+1d10 [--trials 100000] [--strategy fewest] [--workers 4] [--seed 1]
+
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import time
+
+from exceptions import FeedbackError
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+
+# how the seer picks dice. fewest spends as few dice as it can, and the lowest ones
+# that do the job; highest throws in its biggest dice until the raise is met
+STRATEGIES = ("fewest","highest")
+
+
+# dice as [(amt, die), ...], rolled into one row per trial, highest first, 0 for no die
+def roll(rng,dice,trials):
+	rolls = [rng.integers(1,die+1,(trials,amt),dtype=numpy.int32) for amt,die in dice]
+	pool = numpy.concatenate(rolls,axis=1) if rolls else numpy.zeros((trials,0),numpy.int32)
+	# a spare empty column so a pool always has a 0 to shift in
+	pool = numpy.concatenate([pool,numpy.zeros((trials,1),numpy.int32)],axis=1)
+	return -numpy.sort(-pool,axis=1)
+
+# drop the k highest dice of each row
+def drop_top(pool,k):
+	n = pool.shape[1]
+	cols = numpy.arange(n)[None,:]+k[:,None]
+	return numpy.where(cols < n,numpy.take_along_axis(pool,numpy.minimum(cols,n-1),axis=1),0)
+
+def drop_at(pool,rows,*cols):
+	pool = pool.copy()
+	for c in cols:
+		pool[rows,c] = 0
+	return -numpy.sort(-pool,axis=1)
+
+
+# one batch of trials. returns [a wins, b wins] and a bincount of the consequence dice
+# each side took
+def simulate(a,b,trials,strategy="fewest",seed=None):
+	if strategy not in STRATEGIES:
+		raise ValueError(f"Unknown strategy {strategy}")
+
+	rng = numpy.random.default_rng(seed)
+	pools = [roll(rng,a,trials),roll(rng,b,trials)]
+	held = numpy.zeros((trials,2),numpy.int32)
+	taken = numpy.zeros((trials,2),numpy.int64)
+	winner = numpy.full(trials,-1)
+	rows = numpy.arange(trials)
+
+	turn = 0
+	while (winner < 0).any() and turn <= sum(p.shape[1] for p in pools)*2:
+		r, s = turn%2, 1-turn%2
+		turn += 1
+		live = winner < 0
+
+		# raise: a held counter die plus the highest die, otherwise the two highest
+		pool = pools[r]
+		countered = held[:,r] > 0
+		raised = numpy.where(countered,held[:,r]+pool[:,0],pool[:,0]+pool[:,1])
+		winner[live & (raised == 0)] = s
+		live &= raised > 0
+		pools[r] = numpy.where(live[:,None],drop_top(pool,numpy.where(countered,1,2)),pool)
+		held[live,r] = 0
+
+		# see, or give
+		pool = pools[s]
+		winner[live & (pool.sum(axis=1) < raised)] = r
+		live &= pool.sum(axis=1) >= raised
+
+		sums = numpy.cumsum(pool,axis=1)
+		k = (sums < raised[:,None]).sum(axis=1)+1
+		seen = drop_top(pool,k)
+		counter = pool[:,0]
+
+		if strategy == "fewest":
+			# the lowest single die that sees it
+			single = numpy.where(pool >= raised[:,None],pool,numpy.iinfo(numpy.int32).max)
+			one = single.argmin(axis=1)
+			has_one = pool[rows,one] >= raised
+
+			# the lowest pair that sees it
+			i, j = numpy.triu_indices(pool.shape[1],1)
+			pairs = pool[:,i]+pool[:,j]
+			pairs = numpy.where((pool[:,j] > 0) & (pairs >= raised[:,None]),pairs,numpy.iinfo(numpy.int32).max)
+			pair = pairs.argmin(axis=1)
+			has_pair = ~has_one & (pairs[rows,pair] < numpy.iinfo(numpy.int32).max)
+
+			k = numpy.where(has_one,1,numpy.where(has_pair,2,k))
+			counter = numpy.where(has_one,pool[rows,one],counter)
+			seen = numpy.where(has_one[:,None],drop_at(pool,rows,one),seen)
+			seen = numpy.where(has_pair[:,None],drop_at(pool,rows,i[pair],j[pair]),seen)
+
+		pools[s] = numpy.where(live[:,None],seen,pool)
+		held[live & (k == 1),s] = counter[live & (k == 1)]
+		taken[live & (k >= 3),s] += k[live & (k >= 3)]
+
+	wins = [int((winner == 0).sum()),int((winner == 1).sum())]
+	return wins, [numpy.bincount(taken[:,side]).tolist() for side in (0,1)]
+
+
+# the totals of several batches
+class Result():
+	def __init__(self,trials=0):
+		self.trials = trials
+		self.wins = [0,0]
+		self.taken = [[],[]]
+
+	def add(self,wins,taken):
+		for side in (0,1):
+			self.wins[side] += wins[side]
+			counts = self.taken[side]
+			counts.extend([0]*(len(taken[side])-len(counts)))
+			for n,c in enumerate(taken[side]):
+				counts[n] += c
+
+	def win_rate(self,side):
+		return self.wins[side]/self.trials
+
+	def mean_taken(self,side):
+		return sum(n*c for n,c in enumerate(self.taken[side]))/self.trials
+
+	# (consequence dice, chance) for each amount that came up at least 0.1% of the time
+	def taken_odds(self,side):
+		return [(n,c/self.trials) for n,c in enumerate(self.taken[side]) if c/self.trials >= 0.001]
+
+
+# runs trials in batches across worker processes, so neither the bot's event loop nor
+# one core does all of it
+class Simulator():
+	def __init__(self,workers=None,batch=10000,max_trials=1000000,max_dice=30):
+		self.workers = workers or os.cpu_count()
+		self.batch = batch
+		self.max_trials = max_trials
+		self.max_dice = max_dice
+		self.pool = None
+
+	def executor(self):
+		if not self.pool:
+			# never fork: the bot is running threads (the db writer and readers, logging,
+			# discord) by now, and a forked worker can inherit one of their locks held.
+			# workers come from a forkserver with numpy and this module loaded once
+			if "forkserver" in multiprocessing.get_all_start_methods():
+				context = multiprocessing.get_context("forkserver")
+				context.set_forkserver_preload(["sim"])
+			else:
+				context = multiprocessing.get_context("spawn")
+			self.pool = concurrent.futures.ProcessPoolExecutor(self.workers,mp_context=context)
+		return self.pool
+
+	def check(self,a,b,trials,strategy):
+		if not numpy:
+			raise FeedbackError("Simulating needs numpy installed.")
+		if strategy not in STRATEGIES:
+			raise FeedbackError(f"Strategy must be one of {', '.join(STRATEGIES)}.")
+		if trials < 1 or trials > self.max_trials:
+			raise FeedbackError(f"Trials must be between 1 and {self.max_trials}.")
+		if not a or not b:
+			raise FeedbackError("Both sides need some dice!")
+		if max(sum(amt for amt,die in a),sum(amt for amt,die in b)) > self.max_dice:
+			raise FeedbackError(f"That's too many dice to simulate! (max {self.max_dice} a side)")
+
+	def jobs(self,a,b,trials,strategy,seed):
+		seeds = numpy.random.SeedSequence(seed).spawn(-(-trials//self.batch))
+		return [(a,b,min(self.batch,trials-n*self.batch),strategy,s) for n,s in enumerate(seeds)]
+
+	async def run(self,loop,a,b,trials,strategy="fewest",seed=None):
+		self.check(a,b,trials,strategy)
+		result = Result(trials)
+		futures = [loop.run_in_executor(self.executor(),simulate,*job) for job in self.jobs(a,b,trials,strategy,seed)]
+		for future in futures:
+			result.add(*await future)
+		return result
+
+	def run_sync(self,a,b,trials,strategy="fewest",seed=None):
+		self.check(a,b,trials,strategy)
+		result = Result(trials)
+		for wins,taken in self.executor().map(simulate,*zip(*self.jobs(a,b,trials,strategy,seed))):
+			result.add(wins,taken)
+		return result
+
+	def close(self):
+		if self.pool:
+			self.pool.shutdown()
+			self.pool = None
+
+
+def parse(pool):
+	try:
+		return [tuple(int(n) for n in d.split('d')) for d in pool.split('+')]
+	except ValueError:
+		raise argparse.ArgumentTypeError(f"Invalid dice: {pool}")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser()
+	parser.add_argument("a",type=parse,help="the side raising first, eg 3d6+2d8")
+	parser.add_argument("b",type=parse)
+	parser.add_argument("--trials",type=int,default=100000)
+	parser.add_argument("--strategy",choices=STRATEGIES,default="fewest")
+	parser.add_argument("--workers",type=int)
+	parser.add_argument("--seed",type=int)
+	args = parser.parse_args()
+
+	sim = Simulator(args.workers)
+	start = time.perf_counter()
+	try:
+		result = sim.run_sync(args.a,args.b,args.trials,args.strategy,args.seed)
+	except FeedbackError as e:
+		parser.error(str(e))
+	finally:
+		sim.close()
+
+	print(f"{args.trials} conflicts in {time.perf_counter()-start:.2f}s ({args.strategy})")
+	for side,name in enumerate(("a","b")):
+		print(f"{name} wins {result.win_rate(side):.1%}, takes {result.mean_taken(side):.2f} consequence dice on average")
+		print("   "+", ".join(f"{n}: {p:.1%}" for n,p in result.taken_odds(side)))
@@ -0,0 +1,192 @@
+import asyncio
+import contextlib
+import contextvars
+import itertools
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import Metrics
+
+
+# everything one command writes: the statements to commit together, how each cached
+# object it touched looked beforehand in case they have to be rolled back, and the
+# replies that only go out once it has committed
+class Unit():
+	def __init__(self):
+		self.statements = []
+		self.snapshots = {}
+		self.replies = []
+		self.reads = 0
+
+	def rollback(self):
+		for obj,snapshot in self.snapshots.items():
+			obj.restore(snapshot)
+
+
+# how sqlite is set up on every connection. journal_mode and synchronous are what
+# decide durability: with synchronous full a commit is on disk when it returns, with
+# normal under wal a power cut can lose the last few commits but never corrupts the db
+class Profile():
+	def __init__(self,journal_mode=None,synchronous=None,mmap_size=0,cached_statements=128,wal_autocheckpoint=None,checkpoint_idle=None,integrity_check=None):
+		self.journal_mode = journal_mode
+		self.synchronous = synchronous
+		self.mmap_size = mmap_size
+		self.cached_statements = cached_statements
+		self.wal_autocheckpoint = wal_autocheckpoint
+		self.checkpoint_idle = checkpoint_idle
+		self.integrity_check = integrity_check
+
+	def pragmas(self):
+		pragmas = [("journal_mode",self.journal_mode),("synchronous",self.synchronous),("mmap_size",self.mmap_size),("wal_autocheckpoint",self.wal_autocheckpoint)]
+		return [f"PRAGMA {k} = {v}" for k,v in pragmas if v]
+
+
+# default is sqlite's own: a rollback journal, synchronous full. durable and fast both
+# move to wal, so a commit is one append instead of a journal write plus the db write,
+# and readers stop blocking the writer. commits don't pay for checkpoints, those wait
+# until writes have been quiet for checkpoint_idle seconds, with wal_autocheckpoint
+# (in pages) as a backstop for when the bot is never quiet
+profiles = {
+	"default": Profile(),
+	"durable": Profile("wal","full",256*1024*1024,1024,10000,30,"quick"),
+	"fast": Profile("wal","normal",256*1024*1024,1024,10000,30,"quick"),
+}
+
+
+# keeps sqlite off the event loop: every write goes through one writer thread so
+# they stay serialized and in order, reads fan out over a small pool of readers
+class Storage():
+	def __init__(self,path="db.db",readers=2,metrics=None,profile="default"):
+		self.path = path
+		self.profile = profiles[profile] if isinstance(profile,str) else profile
+		self.metrics = metrics or Metrics()
+		self.last_write = None
+		self.local = threading.local()
+		self.writer = ThreadPoolExecutor(1,"db-writer")
+		self.readers = ThreadPoolExecutor(readers,"db-reader")
+		self.rowids = {}
+		self.unit = contextvars.ContextVar("unit",default=None)
+
+	# each executor thread gets its own connection
+	@property
+	def con(self):
+		con = getattr(self.local,"con",None)
+		if not con:
+			con = self.local.con = sqlite3.connect(self.path,cached_statements=self.profile.cached_statements)
+			con.execute("PRAGMA foreign_keys = ON")
+			for pragma in self.profile.pragmas():
+				con.execute(pragma).fetchall()
+		return con
+
+	# blocking, for startup: refuse a database that sqlite says is damaged
+	def check(self):
+		if not self.profile.integrity_check:
+			return
+		rows = self.run(lambda con: con.execute(f"PRAGMA {self.profile.integrity_check}_check").fetchall())
+		if rows != [("ok",)]:
+			raise sqlite3.DatabaseError("Integrity check failed: "+"; ".join(r[0] for r in rows[:10]))
+
+	# copies the wal back into the db from the writer thread once nothing has been
+	# written for checkpoint_idle seconds. passive, so it never waits on readers
+	async def checkpoint_when_idle(self):
+		idle = self.profile.checkpoint_idle
+		while True:
+			await asyncio.sleep(idle)
+			if self.last_write and time.monotonic()-self.last_write >= idle:
+				await asyncio.wrap_future(self.writer.submit(self.checkpoint))
+
+	def checkpoint(self):
+		busy, frames, done = self.con.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+		self.metrics.count("checkpoints")
+		if not busy and frames == done:
+			self.last_write = None
+
+	# blocking, for setup before the event loop is running
+	def run(self,fn):
+		return self.writer.submit(lambda: fn(self.con)).result()
+
+	def query(self,sql,params=()):
+		return self.readers.submit(self.fetch,sql,params).result()
+
+	async def read(self,sql,params=()):
+		unit = self.unit.get()
+		if unit is not None:
+			unit.reads += 1
+		return await asyncio.get_running_loop().run_in_executor(self.readers,self.fetch,sql,params)
+
+	def fetch(self,sql,params):
+		cur = self.con.execute(sql,params)
+		rows = cur.fetchall()
+		cur.close()
+		self.metrics.count("queries")
+		self.metrics.count("rows_read",len(rows))
+		return rows
+
+	def write(self,sql,params=()):
+		self.write_many([(sql,params)])
+
+	# writes only ever go out as part of a transaction, so a failure reaches whoever made them
+	def write_many(self,statements):
+		unit = self.unit.get()
+		if unit is None:
+			raise RuntimeError("Writes have to be made inside Storage.transaction()")
+		unit.statements += statements
+
+	# call before changing a cached object so a failed command can put it back
+	def remember(self,obj):
+		unit = self.unit.get()
+		if unit is not None and obj not in unit.snapshots:
+			unit.snapshots[obj] = obj.snapshot()
+
+	# writes made inside are held back and committed once at the end, or dropped
+	# (and the cache restored) if anything raises. nested transactions join the outer one
+	@contextlib.asynccontextmanager
+	async def transaction(self):
+		if self.unit.get() is not None:
+			yield self.unit.get()
+			return
+
+		unit = Unit()
+		token = self.unit.set(unit)
+		try:
+			yield unit
+			if unit.statements:
+				start = time.perf_counter()
+				await asyncio.wrap_future(self.writer.submit(self.execute_many,unit.statements))
+				self.metrics.observe_commit(time.perf_counter()-start)
+		except BaseException:
+			unit.rollback()
+			raise
+		finally:
+			self.unit.reset(token)
+
+	# runs of the same statement, like a batch of inserts, go through one executemany
+	def execute_many(self,statements):
+		con = self.con
+		try:
+			for sql,run in itertools.groupby(statements,key=lambda s:s[0]):
+				con.executemany(sql,[params for _,params in run])
+			con.commit()
+			self.last_write = time.monotonic()
+			self.metrics.count("queries",len(statements))
+			self.metrics.count("commits")
+		except Exception:
+			con.rollback()
+			raise
+
+	# rowids are handed out here so inserts don't have to wait on the writer for lastrowid.
+	# a table can come as a tuple of tables sharing its ids, eg with its archive copy
+	def load_rowids(self,tables):
+		for t in tables:
+			t = (t,) if isinstance(t,str) else t
+			self.rowids[t[0]] = max(self.query(f"SELECT IFNULL(MAX(rowid),0) FROM {x}")[0][0] for x in t)
+
+	def next_rowid(self,table):
+		self.rowids[table] += 1
+		return self.rowids[table]
+
+	def close(self):
+		self.writer.shutdown()
+		self.readers.shutdown()